@@ -0,0 +1,148 @@
+"""
+Regression checks of the fast paths against the original row by row code, on synthetic data.
+
+    python benchmarks/check_equivalence.py
+    python benchmarks/check_equivalence.py --nodes 5 --years 1.5
+
+1. Strategy.apply_rules_to_index (the compiled month x day of week x hour mask) gives the same
+   bids as index.map(apply_rules), with and without seasonal rules, with and without prices.
+2. An incremental update_run over a truncated CSV gives the same results as get_performance
+   over the full data.
+
+Exits with 1 when a check fails.
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+
+import matplotlib
+matplotlib.use('Agg')
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARKS_PATH), 'src'))
+# No progress bars in the reports
+os.environ.setdefault('TQDM_DISABLE', '1')
+
+import numpy as np
+import pandas as pd
+from synthetic_data import generate_virtual_trading_data
+from data_store import get_source_path, list_nodes
+from strategy import Strategy, TimeBasedRule, get_node_data
+from weekday_hour_stats import build_weekday_hour_stats, derive_rules
+from evaluate_by_node import get_performance, evaluate_performance
+from plot_stage import PlotStage
+from incremental import update_run, get_node_strategy
+from results_store import load_results
+
+# Rules of the mask check, with every season and a rule without season
+SEASONAL_RULES = [
+    TimeBasedRule(day_of_week='Monday', hour_range=[0, 1, 2, 20, 21, 22, 23]),
+    TimeBasedRule(day_of_week='Tuesday', hour_range=list(range(4, 10)), season='Summer'),
+    TimeBasedRule(day_of_week='Wednesday', hour_range=[5, 6, 7], season='Winter'),
+    TimeBasedRule(day_of_week='Friday', hour_range=[1, 2, 3, 23], season='Spring'),
+    TimeBasedRule(day_of_week='Sunday', hour_range=[0, 12, 18], season='Fall'),
+]
+# Hours priced row by row in the price aware check, get_offer_price is slow
+PRICE_AWARE_HOURS = 24 * 60
+# Days appended to the CSV, one update_run each
+UPDATE_DAYS = 3
+# Runs of the incremental check and whether their strategies price the bids
+CHECK_RUNS = {'check-inf-bids': False, 'check-price-aware': True}
+RESULT_CHECK_COLUMNS = ['bid_price', 'awarded', 'profit']
+
+
+def check_rules_mask(data_dir: str) -> list:
+    """
+    Compare apply_rules_to_index with index.map(apply_rules) for every node
+    :return: List of failure messages
+    """
+    failures = []
+    for node in list_nodes(data_dir):
+        node_data = get_node_data(node, data_dir=data_dir)
+        for price_aware in [False, True]:
+            strategy = Strategy(node, SEASONAL_RULES, node_data=node_data, price_aware=price_aware)
+            index = node_data.index[-PRICE_AWARE_HOURS:] if price_aware else node_data.index
+            expected = index.map(strategy.apply_rules).to_numpy(dtype=float)
+            result = strategy.apply_rules_to_index(index)
+            if not np.allclose(result, expected, equal_nan=True):
+                n_diff = (~np.isclose(result, expected, equal_nan=True)).sum()
+                failures.append(f"{node} price_aware={price_aware}: {n_diff} of {len(index)} hours differ")
+
+    return failures
+
+
+def check_incremental(data_dir: str, results_dir: str, df_full: pd.DataFrame, first_update: pd.Timestamp) -> list:
+    """
+    Evaluate the rows before first_update, append the next days to the CSV one at a time with an
+    update_run after each of them, and compare with get_performance over the full data
+    :return: List of failure messages
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    source_path = get_source_path(data_dir)
+    df_full[df_full['date'] < first_update].to_csv(source_path, index=False)
+    rules_by_node = derive_rules(build_weekday_hour_stats(data_dir))
+    for run_id, price_aware in CHECK_RUNS.items():
+        for node, rules in rules_by_node.items():
+            node_data = get_node_data(node, data_dir=data_dir)
+            strategy = Strategy(node, rules + SEASONAL_RULES, node_data=node_data, price_aware=price_aware)
+            evaluate_performance(node_data, strategy, run_id=run_id, plot_stage=PlotStage('off'), verbose=False,
+                                 results_dir=results_dir)
+
+    for day in range(UPDATE_DAYS):
+        start, end = first_update + pd.Timedelta(days=day), first_update + pd.Timedelta(days=day + 1)
+        if day == UPDATE_DAYS - 1:
+            end = df_full['date'].max() + pd.Timedelta(hours=1)
+        df_day = df_full[(df_full['date'] >= start) & (df_full['date'] < end)]
+        df_day.to_csv(source_path, mode='a', header=False, index=False)
+        for run_id in CHECK_RUNS:
+            update_run(run_id, data_dir=data_dir, results_dir=results_dir)
+
+    failures = []
+    for run_id in CHECK_RUNS:
+        df_results = load_results(run_id, results_dir=results_dir).set_index(['settlementPoint', 'date'])
+        for node in list_nodes(data_dir):
+            node_data = get_node_data(node, data_dir=data_dir)
+            expected = get_performance(node_data, get_node_strategy(node, run_id, node_data, results_dir))
+            if node not in df_results.index.get_level_values('settlementPoint'):
+                failures.append(f"{run_id} {node}: no results")
+                continue
+            result = df_results.loc[node].reindex(expected.index)
+            for column in RESULT_CHECK_COLUMNS:
+                if not np.allclose(result[column].to_numpy(dtype=float), expected[column].to_numpy(dtype=float),
+                                   equal_nan=True):
+                    failures.append(f"{run_id} {node}: {column} differs from the full evaluation")
+
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the fast paths against the row by row code")
+    parser.add_argument("--nodes", type=int, default=3, help="Number of synthetic nodes")
+    parser.add_argument("--years", type=float, default=1, help="Years of hourly data")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='ercot-check-')
+    try:
+        df_full = generate_virtual_trading_data(n_nodes=args.nodes, years=args.years, seed=args.seed)
+        # Some missing RT prices, as in the real data
+        df_full.loc[df_full.sample(frac=0.01, random_state=args.seed).index, ['SPP_RT', 'return_DA_RT']] = np.nan
+
+        mask_dir = os.path.join(tmp_dir, 'mask')
+        os.makedirs(mask_dir)
+        df_full.to_csv(get_source_path(mask_dir), index=False)
+        checks = {'rules mask': check_rules_mask(mask_dir)}
+
+        first_update = df_full['date'].max().normalize() - pd.Timedelta(days=UPDATE_DAYS - 1)
+        checks['incremental update'] = check_incremental(os.path.join(tmp_dir, 'incremental'),
+                                                         os.path.join(tmp_dir, 'results'), df_full, first_update)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    for check, failures in checks.items():
+        print(f"{check}: {'OK' if len(failures) == 0 else 'FAILED'}")
+        for failure in failures:
+            print(f"    {failure}")
+    sys.exit(1 if any(checks.values()) else 0)
@@ -0,0 +1,213 @@
+"""
+Time and memory of the stages of the evaluation pipeline on synthetic data.
+
+    python benchmarks/run_benchmarks.py --scales 10x1 100x1
+    python benchmarks/run_benchmarks.py --compare benchmarks/baselines/baseline.json
+    python benchmarks/run_benchmarks.py --output benchmarks/baselines/baseline.json
+
+A scale is <nodes>x<years>. Peak memory is the tracemalloc peak, it covers the Python and
+numpy allocations but not the buffers allocated by pyarrow.
+"""
+import io
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+from datetime import datetime
+
+import matplotlib
+matplotlib.use('Agg')
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+# No progress bars in the reports
+os.environ.setdefault('TQDM_DISABLE', '1')
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARKS_PATH), 'src'))
+
+import numpy as np
+import pandas as pd
+from synthetic_data import write_virtual_trading_data
+from data_store import build_store, list_nodes
+from weekday_hour_stats import build_weekday_hour_stats, derive_rules
+from strategy import Strategy, get_node_data
+from evaluate_by_node import get_performance, evaluate_all_nodes
+from results_store import write_node_results
+from results import Results
+
+SCALES = ['10x1', '10x5', '100x1', '100x5', '1000x1', '1000x5']
+DEFAULT_SCALES = ['10x1', '10x5', '100x1']
+STAGES = ['build_store', 'weekday_hour_stats', 'get_node_data', 'apply_rules_map', 'apply_rules_to_index',
+          'evaluate_performance', 'generate_plot', 'evaluate_all_nodes']
+# Nodes used by the per node stages
+SAMPLE_NODES = 10
+BASELINE_PATH = os.path.join(BENCHMARKS_PATH, 'baselines', 'baseline.json')
+RUN_ID = 'benchmark'
+
+
+def parse_scale(scale: str):
+    n_nodes, years = scale.split('x')
+    return int(n_nodes), float(years)
+
+
+def measure(fn, *args, memory: bool = True, **kwargs) -> dict:
+    """
+    Wall time and CPU time of a call and, in a second traced call, its peak memory.
+    tracemalloc slows down code that allocates many small objects, so it is off while timing.
+    """
+    gc.collect()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    fn(*args, **kwargs)
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    measurement = {'wall_s': round(wall, 4), 'cpu_s': round(cpu, 4), 'peak_mb': None}
+
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        fn(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        measurement['peak_mb'] = round(peak / 2 ** 20, 2)
+
+    return measurement
+
+
+def run_scale(scale: str, data_root: str, seed: int = 0, stages: list = None, memory: bool = True) -> dict:
+    """
+    Generate the data of a scale (or reuse it) and measure every stage
+    :param scale: <nodes>x<years>
+    :param data_root: Folder with one data folder per scale
+    :param seed: Seed of the synthetic data
+    :param stages: Optional subset of STAGES
+    :param memory: Also measure the peak memory, every stage runs twice
+    :return: Dict of stage to measurements
+    """
+    stages = stages or STAGES
+    n_nodes, years = parse_scale(scale)
+    data_dir = os.path.join(data_root, f'{scale}-seed{seed}')
+    if not os.path.exists(os.path.join(data_dir, 'virtual_trading_data.csv')):
+        print(f"[{scale}] generating {n_nodes} nodes x {years:g} years")
+        write_virtual_trading_data(data_dir, n_nodes=n_nodes, years=years, seed=seed)
+    results_dir = tempfile.mkdtemp(prefix='results-', dir=data_root)
+
+    measurements = {}
+    store_measurement = measure(build_store, data_dir, memory=memory)
+    if 'build_store' in stages:
+        measurements['build_store'] = store_measurement
+    nodes = list_nodes(data_dir)
+    sample = nodes[:SAMPLE_NODES]
+
+    stats = build_weekday_hour_stats(data_dir)
+    if 'weekday_hour_stats' in stages:
+        measurements['weekday_hour_stats'] = measure(build_weekday_hour_stats, data_dir, memory=memory)
+    rules_by_node = derive_rules(stats, cond=lambda x: x > 1)
+
+    node_data = {node: get_node_data(node, data_dir=data_dir) for node in sample}
+    strategies = {node: Strategy(node, rules_by_node[node], node_data=node_data[node]) for node in sample}
+    first = sample[0]
+
+    if 'get_node_data' in stages:
+        measurements['get_node_data'] = measure(lambda: [get_node_data(node, data_dir=data_dir) for node in sample],
+                                               memory=memory)
+    if 'apply_rules_map' in stages:
+        # Row by row path, one node only
+        measurements['apply_rules_map'] = measure(node_data[first].index.map, strategies[first].apply_rules,
+                                                 memory=memory)
+    if 'apply_rules_to_index' in stages:
+        measurements['apply_rules_to_index'] = measure(strategies[first].apply_rules_to_index, node_data[first].index,
+                                                      memory=memory)
+    if 'evaluate_performance' in stages:
+        def evaluate_sample():
+            for node in sample:
+                df_node = get_performance(node_data[node], strategies[node])
+                write_node_results(df_node, RUN_ID, strategies[node].rules, results_dir=results_dir)
+        measurements['evaluate_performance'] = measure(evaluate_sample, memory=memory)
+    if 'generate_plot' in stages:
+        df_plot = get_performance(node_data[first], strategies[first])
+        image_path = os.path.join(results_dir, 'plot.png')
+        measurements['generate_plot'] = measure(Results(df_plot).generate_plot, dpi=300, image_path=image_path,
+                                                 memory=memory)
+    if 'evaluate_all_nodes' in stages:
+        # The whole run, results written to a temporary store. The plots are timed by generate_plot
+        def evaluate_all():
+            with contextlib.redirect_stdout(io.StringIO()):
+                evaluate_all_nodes(plot_mode='off', data_dir=data_dir, results_dir=results_dir)
+        measurements['evaluate_all_nodes'] = measure(evaluate_all, memory=memory)
+
+    shutil.rmtree(results_dir, ignore_errors=True)
+    for stage, measurement in measurements.items():
+        peak = '' if measurement['peak_mb'] is None else f"{measurement['peak_mb']:>9.1f} MB"
+        print(f"[{scale}] {stage:<22} {measurement['wall_s']:>9.3f} s {peak}")
+
+    return {stage: measurements[stage] for stage in STAGES if stage in measurements}
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.25, min_seconds: float = 0.05) -> list:
+    """
+    Stages slower than the baseline by more than the tolerance (and more than min_seconds)
+    :return: List of (scale, stage, baseline seconds, current seconds)
+    """
+    regressions = []
+    rows = []
+    for scale, stages in current['scales'].items():
+        for stage, measurement in stages.items():
+            base = baseline['scales'].get(scale, {}).get(stage)
+            if base is None:
+                continue
+            ratio = measurement['wall_s'] / base['wall_s'] if base['wall_s'] > 0 else np.nan
+            rows.append({'scale': scale, 'stage': stage, 'baseline_s': base['wall_s'], 'current_s': measurement['wall_s'],
+                         'ratio': ratio, 'baseline_mb': base['peak_mb'], 'current_mb': measurement['peak_mb']})
+            if measurement['wall_s'] > base['wall_s'] * (1 + tolerance) + min_seconds:
+                regressions.append((scale, stage, base['wall_s'], measurement['wall_s']))
+    if rows:
+        print(pd.DataFrame(rows).to_string(index=False, float_format='{:,.3f}'.format))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the evaluation pipeline on synthetic data")
+    parser.add_argument("--scales", nargs="+", default=DEFAULT_SCALES, help=f"Scales <nodes>x<years>, e.g. {SCALES}")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=None, help="Subset of stages")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--no-memory", action="store_true", help="Only time the stages, without tracemalloc")
+    parser.add_argument("--data-root", default=None, help="Keep the generated data in this folder between runs")
+    parser.add_argument("--output", default=None, help="Save the measurements as JSON, e.g. a new baseline")
+    parser.add_argument("--compare", nargs="?", const=BASELINE_PATH, default=None, help="Baseline JSON to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before a stage is a regression")
+    args = parser.parse_args()
+
+    data_root = args.data_root or tempfile.mkdtemp(prefix='ercot-bench-')
+    os.makedirs(data_root, exist_ok=True)
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'seed': args.seed,
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'versions': {'numpy': np.__version__, 'pandas': pd.__version__},
+        'scales': {},
+    }
+    try:
+        for scale in args.scales:
+            report['scales'][scale] = run_scale(scale, data_root, seed=args.seed, stages=args.stages,
+                                                memory=not args.no_memory)
+            if args.output:
+                # Saved after every scale, the largest scales can take hours
+                os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+                with open(args.output, 'w') as f:
+                    json.dump(report, f, indent=2)
+    finally:
+        if args.data_root is None:
+            shutil.rmtree(data_root, ignore_errors=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), tolerance=args.tolerance)
+        for scale, stage, base, current in regressions:
+            print(f"Regression [{scale}] {stage}: {base:.3f} s -> {current:.3f} s")
+        sys.exit(1 if regressions else 0)
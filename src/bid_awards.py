@@ -0,0 +1,217 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from data_store import DATA_PATH, CHUNK_SIZE, BUFFER_ROWS, MANIFEST_FILE, file_signature, read_node
+
+BID_AWARD_STORE_FOLDER = 'bid_award_store'
+QSE_HOURLY_FILE = '_qse_hourly.parquet'
+ROW_GROUP_SIZE = 100_000
+
+# Source file and MW column of every dataset
+DATASETS = {
+    'bids': {'file': 'energy_bids_dataset.csv', 'mw_column': 'MW_totales'},
+    'awards': {'file': 'energy_bid_award_dataset.csv', 'mw_column': 'energyOnlyBidAwardInMW'},
+}
+CSV_DTYPES = {'settlementPointName': 'category', 'qseName': 'category'}
+PRICE_COLUMNS = ['SPP_DA', 'SPP_RT']
+
+
+def get_dataset_path(dataset: str, data_dir: str = DATA_PATH) -> str:
+    return os.path.join(data_dir, BID_AWARD_STORE_FOLDER, f'dataset={dataset}')
+
+
+def get_dataset_node_path(dataset: str, settlement_point_name: str, data_dir: str = DATA_PATH) -> str:
+    return os.path.join(get_dataset_path(dataset, data_dir), f'settlementPoint={settlement_point_name}')
+
+
+def read_dataset_manifest(dataset: str, data_dir: str = DATA_PATH):
+    manifest_path = os.path.join(get_dataset_path(dataset, data_dir), MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def _get_qse_hourly(df_node: pd.DataFrame, mw_column: str) -> pd.DataFrame:
+    # Total MW and number of rows of every QSE in every hour
+    return (df_node.groupby(['date', 'settlementPoint', 'qseName'], observed=True, sort=True)
+            .agg(**{mw_column: (mw_column, 'sum'), 'n_rows': (mw_column, 'size')})
+            .reset_index())
+
+
+def build_dataset(dataset: str, data_dir: str = DATA_PATH, chunk_size: int = CHUNK_SIZE,
+                  buffer_rows: int = BUFFER_ROWS) -> dict:
+    """
+    Convert a bids or awards CSV into a Parquet store partitioned by settlementPoint, with the
+    rows of every node sorted by date and qseName, and the hourly MW of every QSE precomputed.
+    The timestamp is deliveryDate plus hourEnding - 1 hours, and settlementPointName is renamed to
+    settlementPoint, as in the virtual trading data.
+    :param dataset: One of DATASETS
+    :param data_dir: Folder with the source CSV files
+    :param chunk_size: Rows read from the CSV at a time
+    :param buffer_rows: Rows kept in memory before they are written to the node partitions
+    :return: Manifest of the dataset
+    """
+    source_path = os.path.join(data_dir, DATASETS[dataset]['file'])
+    mw_column = DATASETS[dataset]['mw_column']
+    signature = file_signature(source_path)
+    dataset_path = get_dataset_path(dataset, data_dir)
+    tmp_path = dataset_path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    # 1. Stream the CSV into unsorted parts of every node
+    buffers, n_buffered, part_counts = {}, 0, {}
+
+    def flush():
+        for node, frames in buffers.items():
+            node_path = os.path.join(tmp_path, f'settlementPoint={node}')
+            os.makedirs(node_path, exist_ok=True)
+            part = part_counts.get(node, 0)
+            pd.concat(frames, ignore_index=True).to_parquet(os.path.join(node_path, f'chunk-{part:05d}.parquet'),
+                                                            index=False)
+            part_counts[node] = part + 1
+        buffers.clear()
+
+    for chunk in pd.read_csv(source_path, dtype=CSV_DTYPES, chunksize=chunk_size):
+        chunk = chunk.rename(columns={'settlementPointName': 'settlementPoint'})
+        chunk.insert(0, 'date', pd.to_datetime(chunk['deliveryDate'], cache=True)
+                     + pd.to_timedelta(chunk['hourEnding'] - 1, unit='h'))
+        for node, node_chunk in chunk.groupby('settlementPoint', observed=True, sort=False):
+            buffers.setdefault(node, []).append(node_chunk)
+            n_buffered += len(node_chunk)
+        if n_buffered >= buffer_rows:
+            flush()
+            n_buffered = 0
+    flush()
+
+    # 2. Sort every node once and precompute its hourly QSE aggregates
+    node_rows = {}
+    for node in sorted(part_counts):
+        node_path = os.path.join(tmp_path, f'settlementPoint={node}')
+        chunk_paths = sorted(os.path.join(node_path, part) for part in os.listdir(node_path))
+        # Chunks are read one by one, the inferred dtypes of their columns can differ
+        df_node = pd.concat([pd.read_parquet(path) for path in chunk_paths], ignore_index=True)
+        df_node = df_node.astype({'settlementPoint': str, 'qseName': 'category'})
+        df_node = df_node.sort_values(['date', 'qseName'], kind='stable', ignore_index=True)
+        for path in chunk_paths:
+            os.remove(path)
+
+        df_node.to_parquet(os.path.join(node_path, 'part-00000.parquet'), index=False, row_group_size=ROW_GROUP_SIZE)
+        _get_qse_hourly(df_node, mw_column).to_parquet(os.path.join(node_path, QSE_HOURLY_FILE), index=False)
+        node_rows[node] = len(df_node)
+
+    manifest = {'source': signature, 'nodes': sorted(node_rows), 'rows': node_rows}
+    with open(os.path.join(tmp_path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+
+    shutil.rmtree(dataset_path, ignore_errors=True)
+    os.rename(tmp_path, dataset_path)
+
+    return manifest
+
+
+def ensure_dataset(dataset: str, data_dir: str = DATA_PATH) -> dict:
+    """
+    Make sure the store of a dataset exists and matches its source CSV, rebuilding it otherwise
+    """
+    manifest = read_dataset_manifest(dataset, data_dir)
+    source_path = os.path.join(data_dir, DATASETS[dataset]['file'])
+    if manifest is None or manifest['source'] != file_signature(source_path):
+        manifest = build_dataset(dataset, data_dir)
+    return manifest
+
+
+def _date_filters(start=None, end=None):
+    filters = []
+    if start is not None:
+        filters.append(('date', '>=', pd.Timestamp(start)))
+    if end is not None:
+        filters.append(('date', '<=', pd.Timestamp(end)))
+    return filters or None
+
+
+def read_dataset(dataset: str, nodes: list, columns: list = None, start=None, end=None,
+                 data_dir: str = DATA_PATH) -> pd.DataFrame:
+    """
+    Read the rows of some nodes, only their partitions and, with a date range, only the row groups
+    that overlap it (the rows are sorted by date)
+    :param dataset: One of DATASETS
+    :param nodes: List of nodes
+    :param columns: Optional subset of columns to load
+    :param start: Optional first date
+    :param end: Optional last date
+    :param data_dir: Folder with the source CSV files
+    :return: DataFrame with the rows of the nodes, sorted by node and date
+    """
+    manifest = ensure_dataset(dataset, data_dir)
+    frames = [pd.read_parquet(os.path.join(get_dataset_node_path(dataset, node, data_dir), 'part-00000.parquet'),
+                              columns=columns, filters=_date_filters(start, end))
+              for node in nodes if node in manifest['rows']]
+    if len(frames) == 0:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_qse_hourly(dataset: str, nodes: list, start=None, end=None, data_dir: str = DATA_PATH) -> pd.DataFrame:
+    """
+    Precomputed MW of every QSE in every hour of the nodes
+    :return: DataFrame with date, settlementPoint, qseName, the MW column of the dataset and n_rows
+    """
+    manifest = ensure_dataset(dataset, data_dir)
+    frames = [pd.read_parquet(os.path.join(get_dataset_node_path(dataset, node, data_dir), QSE_HOURLY_FILE),
+                              filters=_date_filters(start, end))
+              for node in nodes if node in manifest['rows']]
+    if len(frames) == 0:
+        return pd.DataFrame(columns=['date', 'settlementPoint', 'qseName', DATASETS[dataset]['mw_column'], 'n_rows'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def join_node_prices(df: pd.DataFrame, data_dir: str = DATA_PATH) -> pd.DataFrame:
+    """
+    Inner join of hourly rows with the DA and RT prices of their node, same as a pd.merge on
+    date and settlementPoint. The prices of every node are sorted by date, so each row finds
+    its hour by binary search in the partition of its node.
+    :param df: DataFrame with date and settlementPoint
+    :param data_dir: Folder with the virtual trading data
+    :return: df with the PRICE_COLUMNS, without the rows that have no price
+    """
+    frames = []
+    for node, df_node in df.groupby('settlementPoint', observed=True, sort=True):
+        prices = read_node(node, columns=['date'] + PRICE_COLUMNS, data_dir=data_dir)
+        prices = prices.sort_values('date', kind='stable', ignore_index=True)
+        price_dates = prices['date'].to_numpy(dtype='datetime64[ns]')
+        dates = df_node['date'].to_numpy(dtype='datetime64[ns]')
+        position = np.searchsorted(price_dates, dates)
+        found = position < len(price_dates)
+        found[found] = price_dates[position[found]] == dates[found]
+
+        df_node = df_node[found]
+        price_rows = prices.iloc[position[found]]
+        frames.append(df_node.assign(**{column: price_rows[column].to_numpy(dtype=np.float64)
+                                        for column in PRICE_COLUMNS}))
+    if len(frames) == 0:
+        return df.assign(**{column: pd.Series(dtype=np.float64) for column in PRICE_COLUMNS})
+    return pd.concat(frames, ignore_index=True)
+
+
+def get_qse_profits(nodes: list, start=None, end=None, data_dir: str = DATA_PATH) -> pd.DataFrame:
+    """
+    Hourly cost, income and profit of the awards of every QSE in the nodes, bought at the DA
+    price and sold at the RT price
+    :param nodes: List of nodes
+    :param start: Optional first date
+    :param end: Optional last date
+    :param data_dir: Folder with the source CSV files and the virtual trading data
+    :return: DataFrame with date, settlementPoint, qseName, energyOnlyBidAwardInMW, the prices,
+             costs, income and profit
+    """
+    mw_column = DATASETS['awards']['mw_column']
+    df_awards = join_node_prices(read_qse_hourly('awards', nodes, start, end, data_dir), data_dir)
+    df_awards['costs'] = df_awards[mw_column] * df_awards['SPP_DA']
+    df_awards['income'] = df_awards[mw_column] * df_awards['SPP_RT']
+    df_awards['profit'] = df_awards['income'] - df_awards['costs']
+
+    return df_awards
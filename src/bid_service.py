@@ -0,0 +1,273 @@
+import json
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+from data_store import DATA_PATH, ensure_store, list_nodes, read_node, read_appended, source_signature
+from results_store import RESULTS_PATH, list_result_nodes, read_node_metadata
+from strategy import get_offer_prices, get_strategy_from_metadata
+
+HOURS = 24
+# Same window as Strategy.get_offer_price: the same hour from 7 to 2 days before the operating day
+WINDOW_START_DAYS = 7
+WINDOW_END_DAYS = 2
+# Enough days to price the last day of the data and the day after it
+HISTORY_DAYS = WINDOW_START_DAYS + 1
+INDEX_COLUMNS = ['date', 'settlementPoint', 'SPP_RT']
+
+
+class BidIndex:
+    """
+    Rolling same-hour RT statistics of every node, enough to price a day without the node data:
+    the daily sum and count of SPP_RT of the last days and the all-history sum and count of every hour
+    """
+
+    def __init__(self, data_dir: str = DATA_PATH, history_days: int = HISTORY_DAYS):
+        self.data_dir = data_dir
+        self.history_days = history_days
+        self.build()
+
+    def build(self):
+        """
+        Index the whole store, one node partition at a time
+        """
+        manifest = ensure_store(self.data_dir)
+        self.source = manifest['source']
+        self.prefix_hash = manifest.get('prefix_hash')
+        self.n_rows = sum(manifest['rows'].values())
+
+        self.nodes = []
+        self.node_position = {}
+        self.hour_sum = np.zeros((0, HOURS))
+        self.hour_count = np.zeros((0, HOURS), dtype=np.int64)
+        self.day_sum = np.zeros((0, self.history_days, HOURS))
+        self.day_count = np.zeros((0, self.history_days, HOURS), dtype=np.int64)
+        self.first_day = None
+        self.last_day = None
+
+        for node in list_nodes(self.data_dir):
+            df_node = read_node(node, columns=['date', 'SPP_RT'], data_dir=self.data_dir)
+            self.add_rows(df_node.assign(settlementPoint=node))
+
+    def _add_nodes(self, nodes: list):
+        new_nodes = [node for node in dict.fromkeys(nodes) if node not in self.node_position]
+        if len(new_nodes) == 0:
+            return
+        for node in new_nodes:
+            self.node_position[node] = len(self.nodes)
+            self.nodes.append(node)
+        n_new = len(new_nodes)
+        self.hour_sum = np.concatenate([self.hour_sum, np.zeros((n_new, HOURS))])
+        self.hour_count = np.concatenate([self.hour_count, np.zeros((n_new, HOURS), dtype=np.int64)])
+        self.day_sum = np.concatenate([self.day_sum, np.zeros((n_new, self.history_days, HOURS))])
+        self.day_count = np.concatenate([self.day_count, np.zeros((n_new, self.history_days, HOURS), dtype=np.int64)])
+
+    def _roll_days(self, last_day: np.datetime64):
+        # Move the window of days forward so it ends at last_day
+        if self.last_day is not None and last_day <= self.last_day:
+            return
+        shift = self.history_days if self.last_day is None else int((last_day - self.last_day).astype(int))
+        keep = max(self.history_days - shift, 0)
+        day_sum = np.zeros_like(self.day_sum)
+        day_count = np.zeros_like(self.day_count)
+        if keep > 0:
+            day_sum[:, :keep] = self.day_sum[:, -keep:]
+            day_count[:, :keep] = self.day_count[:, -keep:]
+        self.day_sum, self.day_count = day_sum, day_count
+        self.last_day = last_day
+
+    def add_rows(self, df: pd.DataFrame):
+        """
+        Add new RT prices to the index
+        :param df: DataFrame with date, settlementPoint and SPP_RT
+        """
+        if len(df) == 0:
+            return
+        self._add_nodes(df['settlementPoint'].astype(str).unique())
+        node_idx = df['settlementPoint'].astype(str).map(self.node_position).to_numpy()
+        dates = pd.DatetimeIndex(df['date'])
+        days = dates.values.astype('datetime64[D]')
+        hours = dates.hour.to_numpy()
+        rt = df['SPP_RT'].to_numpy(dtype=float)
+        # Same handling of the missing prices as strategy.get_window_means
+        has_price = ~np.isnan(rt)
+        rt = np.where(has_price, rt, 0.0)
+
+        n_nodes = len(self.nodes)
+        flat_hour = node_idx * HOURS + hours
+        self.hour_sum += np.bincount(flat_hour, rt, minlength=n_nodes * HOURS).reshape(n_nodes, HOURS)
+        self.hour_count += np.bincount(flat_hour, has_price, minlength=n_nodes * HOURS).reshape(n_nodes, HOURS).astype(np.int64)
+
+        self._roll_days(days.max())
+        self.first_day = days.min() if self.first_day is None else min(self.first_day, days.min())
+        slot = (days - self.last_day).astype(int) + self.history_days - 1
+        in_window = slot >= 0
+        size = n_nodes * self.history_days * HOURS
+        flat_day = ((node_idx * self.history_days + slot) * HOURS + hours)[in_window]
+        self.day_sum += np.bincount(flat_day, rt[in_window], minlength=size).reshape(self.day_sum.shape)
+        self.day_count += np.bincount(flat_day, has_price[in_window], minlength=size).reshape(self.day_count.shape).astype(np.int64)
+
+    def refresh(self) -> int:
+        """
+        Bring the index up to date with the source data, adding only the rows appended since the
+        last refresh. The store is rebuilt (and the index with it) when the CSV was not only appended to.
+        :return: Number of new rows
+        """
+        if source_signature(self.data_dir) == self.source:
+            return 0
+        manifest = ensure_store(self.data_dir)
+        # The new rows can be added to the index only when the store appended them to the version it indexed
+        appended = manifest.get('appended_from') == {'size': self.source['size'], 'prefix_hash': self.prefix_hash}
+        n_new = sum(manifest['rows'].values()) - self.n_rows
+        new_rows = read_appended(self.source['size'], INDEX_COLUMNS, self.data_dir) if appended else None
+        if new_rows is None or len(new_rows) != n_new:
+            # The store was rebuilt, the byte offsets of its parts do not follow the index anymore
+            self.build()
+            return n_new
+
+        self.add_rows(new_rows)
+        self.source = manifest['source']
+        self.prefix_hash = manifest['prefix_hash']
+        self.n_rows += n_new
+        return n_new
+
+    def get_bid_curves(self, operating_day, min_margen: float = 5) -> pd.DataFrame:
+        """
+        Offer price of every hour of an operating day for all the nodes, same as Strategy.get_offer_price
+        :param operating_day: Day to bid for
+        :param min_margen: Margin subtracted from the same-hour RT mean
+        :return: DataFrame indexed by node with one column per hour ending (1 to 24)
+        """
+        day = np.datetime64(pd.Timestamp(operating_day).normalize(), 'D')
+        first_slot = self.history_days - 1 - int((self.last_day - day).astype(int)) - WINDOW_START_DAYS
+        last_slot = first_slot + WINDOW_START_DAYS - WINDOW_END_DAYS
+        if first_slot < 0 and self.first_day <= self.last_day - self.history_days:
+            raise ValueError(f"{pd.Timestamp(day).date()} is older than the {self.history_days} days kept in the index")
+
+        window = slice(max(first_slot, 0), max(min(last_slot + 1, self.history_days), 0))
+        window_sum = self.day_sum[:, window].sum(axis=1)
+        window_count = self.day_count[:, window].sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            window_mean = window_sum / window_count
+            hour_mean = self.hour_sum / self.hour_count
+        bid_prices = get_offer_prices(window_mean, window_count, hour_mean, np.reshape(min_margen, (-1, 1)))
+
+        return pd.DataFrame(bid_prices, index=pd.Index(self.nodes, name='settlementPoint'),
+                            columns=pd.RangeIndex(1, HOURS + 1, name='hour_ending'))
+
+
+def get_run_strategies(run_id: str, nodes: list, results_dir: str = RESULTS_PATH) -> dict:
+    """
+    Strategies of some nodes of a run, without node data, only the rules and the parameters are used
+    """
+    return {node: get_strategy_from_metadata(read_node_metadata(node, run_id, results_dir), node_data=pd.DataFrame())
+            for node in nodes}
+
+
+class BidService:
+    """
+    Bid curves of the next operating days, served from a BidIndex that follows the source data
+    """
+
+    def __init__(self, run_id: str = None, data_dir: str = DATA_PATH, results_dir: str = RESULTS_PATH):
+        self.index = BidIndex(data_dir)
+        self.run_id = run_id
+        self.results_dir = results_dir
+        self._lock = threading.Lock()
+        self._strategies = {}
+
+    def get_bids(self, operating_day, nodes: list = None) -> pd.DataFrame:
+        """
+        24 hour bid curve of an operating day. Without a run every hour gets the offer price,
+        with a run the hours where none of the rules of the node apply get -inf, as in Strategy.apply_rules,
+        and so do all the hours of the nodes that are not in the run.
+        :param operating_day: Day to bid for
+        :param nodes: Optional subset of nodes
+        :return: DataFrame indexed by node with one column per hour ending
+        """
+        with self._lock:
+            self.index.refresh()
+            nodes = self.index.nodes if nodes is None else nodes
+            if self.run_id is None:
+                return self.index.get_bid_curves(operating_day).reindex(nodes)
+
+            # Only the requested nodes of the run are loaded, the other nodes have no rules
+            run_nodes = set(list_result_nodes(self.run_id, self.results_dir))
+            missing = [node for node in dict.fromkeys(nodes) if node in run_nodes and node not in self._strategies]
+            self._strategies.update(get_run_strategies(self.run_id, missing, self.results_dir))
+            # The margin of the nodes that are not loaded does not matter, none of their hours are returned
+            min_margen = np.array([self._strategies[node].min_margen if node in self._strategies else 0
+                                   for node in self.index.nodes])
+            bids = self.index.get_bid_curves(operating_day, min_margen=min_margen).reindex(nodes)
+
+        hours = pd.date_range(pd.Timestamp(operating_day).normalize(), periods=HOURS, freq='h')
+        applicable = np.zeros((len(nodes), HOURS), dtype=bool)
+        for i, node in enumerate(nodes):
+            if node in run_nodes:
+                applicable[i] = self._strategies[node].get_rules_mask()[hours.month - 1, hours.dayofweek, hours.hour]
+        return bids.where(applicable, -np.inf)
+
+
+def to_json(operating_day, bids: pd.DataFrame) -> dict:
+    # Infinite and missing prices are not valid JSON numbers, None means no bid price
+    values = bids.to_numpy()
+    return {
+        'operating_day': str(pd.Timestamp(operating_day).date()),
+        'bids': {node: [float(v) if np.isfinite(v) else None for v in row] for node, row in zip(bids.index, values)},
+    }
+
+
+def serve(service: BidService, host: str = '127.0.0.1', port: int = 8000):
+    """
+    Local HTTP interface: GET /bids?day=YYYY-MM-DD[&node=N0&node=N1] returns the bid curves as JSON
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path != '/bids' or 'day' not in query:
+                return self._send(404, {'error': 'use /bids?day=YYYY-MM-DD'})
+            try:
+                operating_day = query['day'][0]
+                bids = service.get_bids(operating_day, nodes=query.get('node'))
+            except ValueError as e:
+                return self._send(400, {'error': str(e)})
+            except Exception as e:
+                return self._send(500, {'error': f'{type(e).__name__}: {e}'})
+            self._send(200, to_json(operating_day, bids))
+
+        def _send(self, status: int, body: dict):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Serving bids on http://{host}:{port}/bids?day=YYYY-MM-DD")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bid curves of an operating day for all the nodes")
+    parser.add_argument("day", nargs="?", default=None, help="Operating day, the day after the data by default")
+    parser.add_argument("--run-id", default=None, help="Apply the rules of a run, all the hours are priced otherwise")
+    parser.add_argument("--data-dir", default=DATA_PATH, help="Folder with the virtual trading data")
+    parser.add_argument("--results-dir", default=RESULTS_PATH, help="Folder of the results store of the run")
+    parser.add_argument("--serve", action="store_true", help="Serve the bid curves over HTTP")
+    parser.add_argument("--port", type=int, default=8000, help="Port of the HTTP interface")
+    args = parser.parse_args()
+
+    bid_service = BidService(run_id=args.run_id, data_dir=args.data_dir, results_dir=args.results_dir)
+    if args.serve:
+        serve(bid_service, port=args.port)
+    else:
+        day = args.day or pd.Timestamp(bid_service.index.last_day) + pd.Timedelta(days=1)
+        with pd.option_context('display.max_columns', None, 'display.width', 200):
+            print(bid_service.get_bids(day).round(2))
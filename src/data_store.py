@@ -0,0 +1,386 @@
+import os
+import json
+import hashlib
+import shutil
+import numpy as np
+import pandas as pd
+from instrumentation import stage
+
+FILE_PATH = os.path.dirname(__file__)
+DATA_PATH = os.path.join(os.path.dirname(FILE_PATH), 'data')
+
+SOURCE_FILE = 'virtual_trading_data.csv'
+STORE_FOLDER = 'virtual_trading_store'
+# Leading underscore so the file is ignored when the store is read as a Parquet dataset
+MANIFEST_FILE = '_manifest.json'
+TIMESTAMPS_FILE = '_timestamps.parquet'
+MOMENTS_FILE = '_weekday_hour_moments.parquet'
+CACHE_FOLDER = 'cache'
+
+# Compact dtypes of the CSV columns, the dates are parsed after reading each chunk
+CSV_DTYPES = {
+    'settlementPoint': 'category',
+    'SPP_DA': 'float32',
+    'SPP_RT': 'float32',
+    'return_DA_RT': 'float32',
+}
+# The prices are stored as float32 and read back as float64 rounded to cents, the values of the CSV
+FLOAT_COLUMNS = [column for column, dtype in CSV_DTYPES.items() if dtype == 'float32']
+PRICE_DECIMALS = 2
+CHUNK_SIZE = 1_000_000
+BUFFER_ROWS = 5_000_000
+HASH_BLOCK_SIZE = 2 ** 23
+MOMENT_KEYS = ['settlementPoint', 'day_of_week', 'hour']
+
+
+def get_source_path(data_dir: str = DATA_PATH) -> str:
+    return os.path.join(data_dir, SOURCE_FILE)
+
+
+def get_store_path(data_dir: str = DATA_PATH) -> str:
+    return os.path.join(data_dir, STORE_FOLDER)
+
+
+def get_node_path(settlement_point_name: str, data_dir: str = DATA_PATH) -> str:
+    return os.path.join(get_store_path(data_dir), f'settlementPoint={settlement_point_name}')
+
+
+def file_signature(path: str) -> dict:
+    """
+    Identify the current version of a file
+    :return: Dict with the size and modification time of the file
+    """
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def source_signature(data_dir: str = DATA_PATH) -> dict:
+    """
+    Identify the current version of the source CSV
+    :param data_dir: Folder with the virtual trading data
+    :return: Dict with the size and modification time of the source file
+    """
+    return file_signature(get_source_path(data_dir))
+
+
+def read_manifest(data_dir: str = DATA_PATH):
+    manifest_path = os.path.join(get_store_path(data_dir), MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def is_store_current(data_dir: str = DATA_PATH) -> bool:
+    manifest = read_manifest(data_dir)
+    return manifest is not None and manifest['source'] == source_signature(data_dir)
+
+
+def get_prefix_hashes(sizes: list, data_dir: str = DATA_PATH) -> list:
+    """
+    Hash of the first bytes of the source CSV for several sizes, in a single pass over the file.
+    The hash of the bytes ingested into the store tells whether a bigger CSV only has rows appended.
+    :param sizes: Numbers of bytes, in increasing order
+    :param data_dir: Folder with the virtual trading data
+    :return: List with the hex digest of each prefix
+    """
+    hasher = hashlib.sha1()
+    hashes = []
+    position = 0
+    with open(get_source_path(data_dir), 'rb') as f:
+        for size in sizes:
+            while position < size:
+                block = f.read(min(HASH_BLOCK_SIZE, size - position))
+                if len(block) == 0:
+                    raise ValueError(f"The source CSV is smaller than {size} bytes")
+                hasher.update(block)
+                position += len(block)
+            hashes.append(hasher.hexdigest())
+    return hashes
+
+
+def _part_offset(part_name: str) -> int:
+    # part-<offset>-<part>.parquet
+    return int(part_name.split('-')[1])
+
+
+def _ingest(reader, store_path: str, offset: int, node_rows: dict, timestamps: np.ndarray,
+            moments: pd.DataFrame, buffer_rows: int):
+    """
+    Write the chunks of a CSV reader to the node partitions and accumulate timestamps and moments.
+    Part files are named after the byte offset of the CSV they start from, so an interrupted
+    update can be told apart from the rows already in the store.
+    :return: Tuple with the updated timestamps and moments
+    """
+    buffers, n_buffered, part_counts = {}, 0, {}
+
+    def flush():
+        # One new part file per buffered node
+        for node, frames in buffers.items():
+            node_path = os.path.join(store_path, f'settlementPoint={node}')
+            os.makedirs(node_path, exist_ok=True)
+            part = part_counts.get(node, 0)
+            pd.concat(frames, ignore_index=True).to_parquet(
+                os.path.join(node_path, f'part-{offset:012d}-{part:05d}.parquet'), index=False)
+            part_counts[node] = part + 1
+        buffers.clear()
+
+    for chunk in reader:
+        chunk["date"] = pd.to_datetime(chunk["date"], cache=True)
+        timestamps = np.union1d(timestamps, chunk["date"].unique().astype('datetime64[ns]'))
+        # Moments of the returns as they are read back from the store
+        chunk_moments = get_weekday_hour_moments(_to_float64(chunk[['date', 'settlementPoint', 'return_DA_RT']].copy()))
+        moments = chunk_moments if moments is None else moments.add(chunk_moments, fill_value=0)
+
+        for node, node_chunk in chunk.groupby('settlementPoint', observed=True, sort=False):
+            node_chunk = node_chunk.astype({'settlementPoint': str})
+            buffers.setdefault(node, []).append(node_chunk)
+            node_rows[node] = node_rows.get(node, 0) + len(node_chunk)
+            n_buffered += len(node_chunk)
+        if n_buffered >= buffer_rows:
+            flush()
+            n_buffered = 0
+    flush()
+
+    return timestamps, moments
+
+
+def _write_store_files(store_path: str, signature: dict, prefix_hash: str, columns: list, node_rows: dict,
+                       timestamps: np.ndarray, moments: pd.DataFrame, appended_from: dict = None) -> dict:
+    pd.DataFrame({'date': timestamps}).to_parquet(os.path.join(store_path, TIMESTAMPS_FILE), index=False)
+    moments.reset_index().to_parquet(os.path.join(store_path, MOMENTS_FILE), index=False)
+
+    nodes = sorted(node_rows)
+    manifest = {
+        'source': signature,
+        'prefix_hash': prefix_hash,
+        'columns': columns,
+        'nodes': nodes,
+        'rows': {node: node_rows[node] for node in nodes},
+    }
+    if appended_from is not None:
+        # Version of the source the rows were appended to
+        manifest['appended_from'] = appended_from
+    # The manifest is written last, it marks the store as up to date
+    with open(os.path.join(store_path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+
+    return manifest
+
+
+def build_store(data_dir: str = DATA_PATH, chunk_size: int = CHUNK_SIZE, buffer_rows: int = BUFFER_ROWS) -> dict:
+    """
+    Convert the virtual trading CSV into a Parquet store partitioned by settlementPoint.
+    The CSV is streamed in chunks with compact dtypes, so the peak memory depends on the chunk
+    and buffer sizes, not on the size of the market history. In the same pass it collects the
+    timestamps of all the nodes and the weekday x hour moments of return_DA_RT.
+    :param data_dir: Folder with the virtual trading data
+    :param chunk_size: Rows read from the CSV at a time
+    :param buffer_rows: Rows kept in memory before they are written to the node partitions
+    :return: Manifest of the new store
+    """
+    signature = source_signature(data_dir)
+    store_path = get_store_path(data_dir)
+    # Build in a temporary folder and swap it in, so readers never see a half written store
+    tmp_path = store_path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    columns = list(pd.read_csv(get_source_path(data_dir), nrows=0).columns)
+    reader = pd.read_csv(get_source_path(data_dir), dtype=CSV_DTYPES, chunksize=chunk_size)
+    node_rows = {}
+    timestamps, moments = _ingest(reader, tmp_path, 0, node_rows, np.array([], dtype='datetime64[ns]'),
+                                  None, buffer_rows)
+    prefix_hash = get_prefix_hashes([signature['size']], data_dir)[0]
+    manifest = _write_store_files(tmp_path, signature, prefix_hash, columns, node_rows, timestamps, moments)
+
+    shutil.rmtree(store_path, ignore_errors=True)
+    os.rename(tmp_path, store_path)
+
+    return manifest
+
+
+def update_store(data_dir: str = DATA_PATH, chunk_size: int = CHUNK_SIZE, buffer_rows: int = BUFFER_ROWS) -> dict:
+    """
+    Bring the store up to date with the source CSV. When rows were only appended to the CSV
+    (e.g. a new operating day) just the new bytes are ingested, otherwise the store is rebuilt.
+    :param data_dir: Folder with the virtual trading data
+    :param chunk_size: Rows read from the CSV at a time
+    :param buffer_rows: Rows kept in memory before they are written to the node partitions
+    :return: Manifest of the store, with the number of new rows of each node in 'appended'
+    """
+    manifest = read_manifest(data_dir)
+    signature = source_signature(data_dir)
+    if manifest is None or manifest['source'] == signature:
+        return build_store(data_dir, chunk_size, buffer_rows) if manifest is None else manifest
+
+    # Rows were only appended when the bytes already ingested did not change, otherwise rebuild
+    offset = manifest['source']['size']
+    if 'prefix_hash' not in manifest or signature['size'] <= offset:
+        return build_store(data_dir, chunk_size, buffer_rows)
+    old_hash, prefix_hash = get_prefix_hashes([offset, signature['size']], data_dir)
+    if old_hash != manifest['prefix_hash']:
+        return build_store(data_dir, chunk_size, buffer_rows)
+
+    store_path = get_store_path(data_dir)
+    # Remove the parts left by an update that did not finish
+    for node_folder in os.listdir(store_path):
+        if node_folder.startswith('settlementPoint='):
+            for part in os.listdir(os.path.join(store_path, node_folder)):
+                if _part_offset(part) >= offset:
+                    os.remove(os.path.join(store_path, node_folder, part))
+
+    with open(get_source_path(data_dir), 'rb') as f:
+        f.seek(offset)
+        reader = pd.read_csv(f, header=None, names=manifest['columns'], dtype=CSV_DTYPES, chunksize=chunk_size)
+        node_rows = dict(manifest['rows'])
+        timestamps, moments = _ingest(reader, store_path, offset, node_rows, read_timestamps_file(store_path),
+                                      pd.read_parquet(os.path.join(store_path, MOMENTS_FILE)).set_index(MOMENT_KEYS),
+                                      buffer_rows)
+
+    new_manifest = _write_store_files(store_path, signature, prefix_hash, manifest['columns'], node_rows,
+                                      timestamps, moments,
+                                      appended_from={'size': offset, 'prefix_hash': manifest['prefix_hash']})
+    new_manifest['appended'] = {node: rows - manifest['rows'].get(node, 0) for node, rows in node_rows.items()
+                                if rows != manifest['rows'].get(node, 0)}
+    return new_manifest
+
+
+def get_weekday_hour_moments(virtual_trading_data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Additive statistics of return_DA_RT by node, day of week and hour (count, sum, sum of
+    squares and wins), so the statistics of several chunks can be summed
+    :param virtual_trading_data: DataFrame with date, settlementPoint and return_DA_RT
+    :return: DataFrame indexed by (settlementPoint, day_of_week, hour)
+    """
+    returns = virtual_trading_data["return_DA_RT"].astype(np.float64)
+    df_moments = pd.DataFrame({
+        'settlementPoint': virtual_trading_data["settlementPoint"].astype(str),
+        'day_of_week': virtual_trading_data["date"].dt.dayofweek.astype(np.int8),
+        'hour': virtual_trading_data["date"].dt.hour.astype(np.int8),
+        'count': returns.notna().astype(np.int64),
+        'sum': returns.fillna(0),
+        'sum_sq': returns.fillna(0) ** 2,
+        'wins': (returns > 0).astype(np.int64),
+    })
+    return df_moments.groupby(MOMENT_KEYS).sum()
+
+
+def ensure_store(data_dir: str = DATA_PATH) -> dict:
+    """
+    Make sure the Parquet store exists and matches the source CSV, updating it otherwise
+    :param data_dir: Folder with the virtual trading data
+    :return: Manifest of the store
+    """
+    if not is_store_current(data_dir):
+        with stage('update_store'):
+            return update_store(data_dir)
+    return read_manifest(data_dir)
+
+
+def list_nodes(data_dir: str = DATA_PATH) -> list:
+    return ensure_store(data_dir)['nodes']
+
+
+def _to_float64(df: pd.DataFrame) -> pd.DataFrame:
+    # float32 keeps about 7 significant digits, enough to restore prices in cents exactly
+    float_columns = [column for column in FLOAT_COLUMNS if column in df.columns]
+    if len(float_columns) > 0:
+        df[float_columns] = df[float_columns].astype(np.float64).round(PRICE_DECIMALS)
+    return df
+
+
+def read_node(settlement_point_name: str, columns: list = None, data_dir: str = DATA_PATH) -> pd.DataFrame:
+    """
+    Read the raw virtual trading rows of a single node from the store
+    :param settlement_point_name: Name of the settlement point
+    :param columns: Optional subset of columns to load
+    :param data_dir: Folder with the virtual trading data
+    :return: DataFrame with the rows of the node, empty if the node is unknown
+    """
+    manifest = ensure_store(data_dir)
+    node_path = get_node_path(settlement_point_name, data_dir)
+    if not os.path.exists(node_path):
+        # Same behaviour as filtering the CSV: no rows, but the usual columns
+        schema_path = get_node_path(manifest['nodes'][0], data_dir)
+        return _to_float64(pd.read_parquet(schema_path, columns=columns).iloc[0:0])
+    return _to_float64(pd.read_parquet(node_path, columns=columns))
+
+
+def read_all(columns: list = None, data_dir: str = DATA_PATH) -> pd.DataFrame:
+    """
+    Read the rows of all the nodes from the store
+    :param columns: Optional subset of columns to load
+    :param data_dir: Folder with the virtual trading data
+    :return: DataFrame with the virtual trading data
+    """
+    ensure_store(data_dir)
+    # settlementPoint is already a column of the files, do not add it again from the folder names
+    return _to_float64(pd.read_parquet(get_store_path(data_dir), columns=columns, partitioning=None))
+
+
+def read_appended(offset: int, columns: list = None, data_dir: str = DATA_PATH) -> pd.DataFrame:
+    """
+    Read only the rows ingested from the bytes of the CSV after an offset, i.e. the rows that
+    update_store added since the source had that size
+    :param offset: Size of the CSV already known by the caller
+    :param columns: Optional subset of columns to load
+    :param data_dir: Folder with the virtual trading data
+    :return: DataFrame with the new rows of all the nodes
+    """
+    manifest = ensure_store(data_dir)
+    store_path = get_store_path(data_dir)
+    paths = [os.path.join(store_path, node_folder, part)
+             for node_folder in sorted(os.listdir(store_path)) if node_folder.startswith('settlementPoint=')
+             for part in sorted(os.listdir(os.path.join(store_path, node_folder))) if _part_offset(part) >= offset]
+    if len(paths) == 0:
+        return pd.DataFrame(columns=columns or manifest['columns'])
+    return _to_float64(pd.concat([pd.read_parquet(path, columns=columns) for path in paths],
+                                 ignore_index=True))
+
+
+def read_timestamps(data_dir: str = DATA_PATH) -> pd.DatetimeIndex:
+    """
+    Sorted union of the timestamps of all the nodes, collected by the ingest
+    """
+    ensure_store(data_dir)
+    return pd.DatetimeIndex(read_timestamps_file(get_store_path(data_dir)))
+
+
+def read_timestamps_file(store_path: str) -> np.ndarray:
+    return pd.read_parquet(os.path.join(store_path, TIMESTAMPS_FILE))['date'].to_numpy(dtype='datetime64[ns]')
+
+
+def read_weekday_hour_moments(data_dir: str = DATA_PATH) -> pd.DataFrame:
+    """
+    Output of get_weekday_hour_moments for the whole market history, collected by the ingest
+    """
+    ensure_store(data_dir)
+    return pd.read_parquet(os.path.join(get_store_path(data_dir), MOMENTS_FILE))
+
+
+def load_cached_table(name: str, build, data_dir: str = DATA_PATH) -> pd.DataFrame:
+    """
+    Load a table derived from the virtual trading data, building it only when the source changed
+    :param name: Name of the cached table
+    :param build: Function that receives data_dir and returns the table as a DataFrame
+    :param data_dir: Folder with the virtual trading data
+    :return: The cached table
+    """
+    cache_path = os.path.join(data_dir, CACHE_FOLDER)
+    table_path = os.path.join(cache_path, f'{name}.parquet')
+    signature_path = os.path.join(cache_path, f'{name}.json')
+    signature = source_signature(data_dir)
+
+    if os.path.exists(table_path) and os.path.exists(signature_path):
+        with open(signature_path) as f:
+            if json.load(f) == signature:
+                return pd.read_parquet(table_path)
+
+    table = build(data_dir)
+    os.makedirs(cache_path, exist_ok=True)
+    table.to_parquet(table_path)
+    with open(signature_path, 'w') as f:
+        json.dump(signature, f)
+
+    return table
@@ -1,21 +1,73 @@
+import argparse
+import traceback
+import numpy as np
 import pandas as pd
-from os.path import join
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 from strategy import Strategy, get_node_data, TimeBasedRule
 from results import Results
-
-
-def evaluate_performance(df_node: pd.DataFrame, strategy: Strategy) -> pd.DataFrame:
+from data_store import DATA_PATH, ensure_store
+from results_store import (DEFAULT_RUN_ID, RESULTS_PATH, new_run_id, write_run_metadata, write_run_metrics,
+                           load_results, list_result_nodes)
+from metrics import compute_results_metrics
+from plot_stage import PlotStage, PLOT_MODES, init_worker
+from weekday_hour_stats import get_weekday_hour_stats, derive_rules
+from instrumentation import stage, profile_node, enable
+
+METRICS_INPUT_COLUMNS = ['date', 'settlementPoint', 'profit', 'awarded', 'SPP_DA', 'return_DA_RT']
+METRICS_NODES_PER_CHUNK = 100
+
+
+def get_performance(df_node: pd.DataFrame, strategy: Strategy) -> pd.DataFrame:
+    """
+    Bid, award and profit of every hour of df_node. Each hour only depends on its own row and
+    on the node data of the strategy, so new rows can be evaluated on their own.
+    """
     df_node_local = df_node.copy()
-    df_node_local["bid_price"] = df_node_local.index.map(strategy.apply_rules)
+    with stage('apply_rules', node=strategy.settlement_point_name):
+        df_node_local["bid_price"] = strategy.apply_rules_to_index(df_node_local.index)
     df_node_local["awarded"] = (df_node_local["bid_price"] >= df_node_local["SPP_DA"]).astype(int)
     df_node_local["profit"] = (df_node_local["SPP_RT"] - df_node_local["SPP_DA"]) * df_node_local["awarded"]
-    df_node_local["rules"] = ' & '.join([str(rule) for rule in strategy.rules])
-    df_node_local["bid_price"] = df_node_local.apply(lambda x: x["SPP_DA"] + 1 if x["awarded"] == 1 else x["SPP_DA"] - 1, axis=1)
-    r = Results(df_node_local)
-    print(r)
-    r.save_results()
-    r.generate_plot()
+    df_node_local["bid_price"] = np.where(df_node_local["awarded"] == 1, df_node_local["SPP_DA"] + 1, df_node_local["SPP_DA"] - 1)
+
+    return df_node_local
+
+
+def compute_run_metrics(run_id: str, results_dir: str = RESULTS_PATH,
+                        nodes_per_chunk: int = METRICS_NODES_PER_CHUNK) -> pd.DataFrame:
+    """
+    Metrics of all the nodes of a run. The metrics of a node only depend on its own results,
+    so the results are loaded in chunks of nodes and memory is bounded by the chunk.
+    :param run_id: Identifier of the run
+    :param results_dir: Folder of the results store
+    :param nodes_per_chunk: Nodes loaded at a time
+    :return: Output of compute_results_metrics for all the nodes
+    """
+    nodes = list_result_nodes(run_id, results_dir)
+    if len(nodes) == 0:
+        return compute_results_metrics(load_results(run_id, columns=METRICS_INPUT_COLUMNS, results_dir=results_dir))
+    return pd.concat([compute_results_metrics(load_results(run_id, nodes=nodes[start:start + nodes_per_chunk],
+                                                           columns=METRICS_INPUT_COLUMNS, results_dir=results_dir))
+                      for start in range(0, len(nodes), nodes_per_chunk)])
+
+
+def evaluate_performance(df_node: pd.DataFrame, strategy: Strategy, run_id: str = DEFAULT_RUN_ID,
+                         plot_stage: PlotStage = None, verbose: bool = True,
+                         results_dir: str = RESULTS_PATH) -> pd.DataFrame:
+    df_node_local = get_performance(df_node, strategy)
+    params = {'price_aware': strategy.price_aware, 'min_margen': strategy.min_margen}
+    r = Results(df_node_local, rules=strategy.rules, run_id=run_id, params=params, results_dir=results_dir)
+    if verbose:
+        print(r)
+    with stage('save_results', node=r.spp_name):
+        r.save_results()
+    # Full plot rendered right away unless the caller runs its own plot stage
+    with stage('submit_plot', node=r.spp_name):
+        (plot_stage or PlotStage()).submit(r)
+
+    return df_node_local
+
+
 
 def evaluate_nebula():
     # Load the virtual trading data
@@ -234,29 +286,91 @@ def evaluate_lz_north():
     evaluate_performance(node_data, strategy)
 
 
-def evaluate_all_nodes():
-    data_base_path = '../data/'
-    complete_df_sorted = pd.read_csv(join(data_base_path, 'virtual_trading_weekday_hour.csv'))
-    node_list = complete_df_sorted['settlementPoint_'].unique()
-
-    cond = lambda x: x > 1
-    for node in tqdm(node_list):
-        test_node_data = complete_df_sorted[complete_df_sorted['settlementPoint_'] == node].copy()
-
-        df_node_weekly = test_node_data.sort_values(by=["day_of_week_", "hour_"])
-        rules = []
-        for dow in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]:
-            h_list = []
-            for hour in range(24):
-                df_local = df_node_weekly[(df_node_weekly["day_of_week_"] == dow) & (df_node_weekly["hour_"] == hour)]
-                if cond(df_local["return_DA_RT_median"].values[0]):
-                    h_list.append(hour)
-
-            if len(h_list) > 0:
-                rules.append(TimeBasedRule(day_of_week=dow, hour_range=h_list))
+def evaluate_node(node: str, rules: list, run_id: str = DEFAULT_RUN_ID, plot_stage: PlotStage = None,
+                  verbose: bool = True, data_dir: str = DATA_PATH, results_dir: str = RESULTS_PATH):
+    # The node selected with ERCOT_PROFILE_NODE runs under cProfile
+    with profile_node(node), stage('evaluate_node', node=node):
+        with stage('get_node_data', node=node):
+            node_data = get_node_data(node, data_dir=data_dir)
+        strategy = Strategy(node, rules, node_data=node_data)
+        evaluate_performance(node_data, strategy, run_id=run_id, plot_stage=plot_stage, verbose=verbose,
+                             results_dir=results_dir)
+
+
+def _evaluate_node_task(task: tuple):
+    # Runs in the worker processes, errors are returned so one node does not stop the run
+    node, rules, run_id, plot_stage, data_dir, results_dir = task
+    try:
+        evaluate_node(node, rules, run_id=run_id, plot_stage=plot_stage, verbose=False, data_dir=data_dir,
+                      results_dir=results_dir)
+        return node, None
+    except Exception:
+        return node, traceback.format_exc()
+
+
+def evaluate_all_nodes(n_workers: int = 1, statistic: str = 'median', threshold: float = 1,
+                       plot_mode: str = 'full', plot_workers: int = 2, data_dir: str = DATA_PATH,
+                       results_dir: str = RESULTS_PATH):
+    """
+    Evaluate the strategy of every node
+    :param n_workers: Number of processes, nodes are evaluated one by one when 1
+    :param statistic: Weekday hour statistic used to select the hours of the rules
+    :param threshold: Hours are selected when the statistic is above the threshold
+    :param plot_mode: One of PLOT_MODES (off, preview or full)
+    :param plot_workers: Background processes rendering the plots while the nodes are evaluated.
+                         With n_workers > 1 each worker renders the plots of its own nodes
+    :param data_dir: Folder with the virtual trading data
+    :param results_dir: Folder of the results store
+    :return: Dict with the traceback of the nodes (or plots) that failed
+    """
+    # Rules straight from the weekday x hour statistics of the raw data (cached on disk)
+    with stage('derive_rules'):
+        rules_by_node = derive_rules(get_weekday_hour_stats(data_dir), statistic=statistic, cond=lambda x: x > threshold)
+    run_id = new_run_id()
+    write_run_metadata(run_id, {'statistic': statistic, 'threshold': threshold, 'nodes': list(rules_by_node)},
+                       results_dir=results_dir)
+
+    # Build the node store once, each worker reads and decodes only its own partition
+    ensure_store(data_dir)
+    if n_workers > 1:
+        plot_stage = PlotStage(plot_mode)
+        tasks = [(node, rules, run_id, plot_stage, data_dir, results_dir) for node, rules in rules_by_node.items()]
+        with stage('evaluate_nodes', workers=n_workers), \
+                ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker) as executor:
+            # map keeps the order of the nodes
+            outcomes = list(tqdm(executor.map(_evaluate_node_task, tasks), total=len(tasks)))
+        plot_errors = {}
+    else:
+        plot_stage = PlotStage(plot_mode, n_workers=plot_workers)
+        tasks = [(node, rules, run_id, plot_stage, data_dir, results_dir) for node, rules in rules_by_node.items()]
+        with stage('evaluate_nodes', workers=n_workers):
+            outcomes = [_evaluate_node_task(task) for task in tqdm(tasks)]
+        with stage('wait_plots'):
+            plot_errors = plot_stage.wait()
+
+    errors = {node: error for node, error in outcomes if error is not None}
+    errors.update({f'{node} (plot)': error for node, error in plot_errors.items()})
+    for node, error in errors.items():
+        print(f"Node {node} failed:\n{error}")
+
+    # Summary of all the nodes in one table instead of one printed report per node
+    with stage('metrics'):
+        df_metrics = compute_run_metrics(run_id, results_dir)
+        write_run_metrics(run_id, df_metrics, results_dir=results_dir)
+    print(df_metrics.sort_values('total_profit', ascending=False).to_string(float_format='{:,.2f}'.format))
+
+    return errors
 
-        strategy = Strategy(node, rules)
-        evaluate_performance(get_node_data(node), strategy)
 
 if __name__ == "__main__":
-    evaluate_all_nodes()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Evaluate the strategy for all the nodes")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--plots", choices=list(PLOT_MODES), default="full", help="Plot mode")
+    parser.add_argument("--plot-workers", type=int, default=2, help="Background processes rendering the plots")
+    parser.add_argument("--instrument", default=None, help="Record the time of every stage in this JSON lines file")
+    parser.add_argument("--instrument-memory", action="store_true", help="Also record the peak memory of the stages")
+    parser.add_argument("--profile-node", default=None, help="Save a cProfile of the evaluation of this node")
+    args = parser.parse_args()
+    if args.instrument or args.profile_node:
+        enable(args.instrument, memory=args.instrument_memory, profile_node=args.profile_node)
+    evaluate_all_nodes(n_workers=args.workers, plot_mode=args.plots, plot_workers=args.plot_workers)
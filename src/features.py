@@ -0,0 +1,181 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from data_store import DATA_PATH, list_nodes, read_node, load_cached_table
+
+FEATURES_TABLE = 'node_features'
+FEATURE_INPUT_COLUMNS = ['date', 'settlementPoint', 'return_DA_RT']
+ROLLING_WINDOW = 24
+NODES_PER_CHUNK = 50
+
+FEATURE_COLUMNS = [
+    'mean_returns', 'std_returns', 'skew_returns', 'kurt_returns', 'max_return', 'min_return', 'median_return',
+    'rolling_std', 'mad', 'max_min_diff', 'var_return', 'expected_shortfall_return', 'drawdown',
+    'proportion_positiv_ret', 'proportion_negativ_ret', 'return_25_quantile', 'return_50_quantile',
+    'return_75_quantile',
+    *[f'avg_{h}_returns' for h in range(24)],
+    *[f'std_{h}_returns' for h in range(24)],
+    'mean_cum_returns',
+]
+
+
+def _sorted_quantile(sorted_values: np.ndarray, starts: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+    # Linear interpolation, as pandas quantile, over the non NaN values at the start of each group
+    with np.errstate(invalid='ignore'):
+        position = q * (counts - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        low_values = sorted_values[np.clip(starts + low, 0, len(sorted_values) - 1)]
+        high_values = sorted_values[np.clip(starts + high, 0, len(sorted_values) - 1)]
+        return np.where(counts > 0, low_values + (high_values - low_values) * (position - low), np.nan)
+
+
+def _window_diff(prefix: np.ndarray, window: int) -> np.ndarray:
+    # Sum of the last `window` values ending at every row, from a prefix sum with a leading 0
+    ends = np.arange(len(prefix) - 1)
+    return prefix[ends + 1] - prefix[np.maximum(ends + 1 - window, 0)]
+
+
+def _group_mean(values: np.ndarray, group: np.ndarray, keep: np.ndarray, n_groups: int) -> np.ndarray:
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (np.bincount(group[keep], values[keep], minlength=n_groups)
+                / np.bincount(group[keep], minlength=n_groups))
+
+
+def get_node_features(df: pd.DataFrame, window: int = ROLLING_WINDOW) -> pd.DataFrame:
+    """
+    Features of the return_DA_RT series of every node, the same as feature_extraction in
+    notebooks/feature_extraction.ipynb but computed for all the nodes at once with grouped sums
+    over the rows sorted by node, prefix sums for the rolling windows and one sort for the quantiles.
+    proportion_positiv_ret is the share of positive returns, the notebook used the length of the
+    boolean mask so it was always 1.
+    :param df: DataFrame with date, settlementPoint and return_DA_RT, the rows of each node in time order
+    :param window: Hours of the rolling windows
+    :return: DataFrame indexed by settlementPoint with the FEATURE_COLUMNS
+    """
+    codes, nodes = pd.factorize(df['settlementPoint'].astype(str), sort=True)
+    order = np.argsort(codes, kind='stable')
+    group = codes[order]
+    x = df['return_DA_RT'].to_numpy(dtype=np.float64)[order]
+    hours = pd.DatetimeIndex(df['date']).hour.to_numpy()[order]
+    n_groups = len(nodes)
+
+    n_rows = np.bincount(group, minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(n_rows)[:-1]])
+    valid = ~np.isnan(x)
+    x0 = np.where(valid, x, 0.0)
+
+    # 1. Basic statistics, from the moments around the mean of each node
+    count = np.bincount(group, valid, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(group, x0, minlength=n_groups) / count
+        d = np.where(valid, x - mean[group], 0.0)
+        m2 = np.bincount(group, d ** 2, minlength=n_groups)
+        m3 = np.bincount(group, d ** 3, minlength=n_groups)
+        m4 = np.bincount(group, d ** 4, minlength=n_groups)
+        std = np.where(count > 1, np.sqrt(m2 / (count - 1)), np.nan)
+        # Bias corrected skew and excess kurtosis, as pandas
+        skew = np.sqrt(count * (count - 1)) / (count - 2) * (m3 / count) / (m2 / count) ** 1.5
+        skew = np.where(count < 3, np.nan, np.where(m2 == 0, 0, skew))
+        kurt = (count * (count + 1) * (count - 1) * m4 / ((count - 2) * (count - 3) * m2 ** 2)
+                - 3 * (count - 1) ** 2 / ((count - 2) * (count - 3)))
+        kurt = np.where(count < 4, np.nan, np.where(m2 == 0, 0, kurt))
+        mad = np.bincount(group, np.abs(d), minlength=n_groups) / count
+
+    max_return = np.fmax.reduceat(x, starts)
+    min_return = np.fmin.reduceat(x, starts)
+
+    # Quantiles: a single sort by node and return, the NaN returns go to the end of each node
+    sorted_x = x[np.lexsort((x, group))]
+    quantiles = {q: _sorted_quantile(sorted_x, starts, count, q) for q in [0.05, 0.25, 0.5, 0.75]}
+
+    # 2. Volatility of the rolling windows, only the windows with `window` returns inside one node
+    position = np.arange(len(x)) - starts[group]
+    n_nan = _window_diff(np.concatenate([[0], np.cumsum(~valid)]), window)
+    full_window = (position >= window - 1) & (n_nan == 0)
+    sum_d = _window_diff(np.concatenate([[0.0], np.cumsum(d)]), window)
+    sum_d2 = _window_diff(np.concatenate([[0.0], np.cumsum(d ** 2)]), window)
+    rolling_var = np.maximum((sum_d2 - sum_d ** 2 / window) / (window - 1), 0)
+    rolling_std = _group_mean(np.sqrt(rolling_var), group, full_window, n_groups)
+
+    range_by_window = np.full(len(x), np.nan)
+    if len(x) >= window:
+        windows = sliding_window_view(x, window)
+        range_by_window[window - 1:] = windows.max(axis=1) - windows.min(axis=1)
+    max_min_diff = _group_mean(range_by_window, group, full_window, n_groups)
+
+    # Risk metrics
+    var_return = quantiles[0.05]
+    with np.errstate(invalid='ignore'):
+        below_var = valid & (x < var_return[group])
+    expected_shortfall = _group_mean(x, group, below_var, n_groups)
+    running_max = pd.Series(x).groupby(group).cummax().to_numpy()
+    drawdown = np.fmin.reduceat(x - running_max, starts)
+
+    # Returns distribution
+    proportion_positive = np.bincount(group, x > 0, minlength=n_groups) / n_rows
+
+    # Time domain features, mean and std of every hour of the day
+    group_hour = group * 24 + hours
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hour_count = np.bincount(group_hour, valid, minlength=n_groups * 24)
+        hour_mean = np.bincount(group_hour, x0, minlength=n_groups * 24) / hour_count
+        hour_d = np.where(valid, x - hour_mean[group_hour], 0.0)
+        hour_std = np.sqrt(np.bincount(group_hour, hour_d ** 2, minlength=n_groups * 24) / (hour_count - 1))
+    hour_std = np.where(hour_count > 1, hour_std, np.nan)
+
+    # Mean of the sum of the returns of the last `window` hours (cumulative sum minus its value `window` rows before)
+    cum_return = _window_diff(np.concatenate([[0.0], np.cumsum(x0)]), window)
+    has_start = np.concatenate([np.zeros(window, dtype=bool), valid[:-window]])[:len(x)]
+    mean_cum_returns = _group_mean(cum_return, group, (position >= window) & valid & has_start, n_groups)
+
+    df_features = pd.DataFrame({
+        'mean_returns': mean,
+        'std_returns': std,
+        'skew_returns': skew,
+        'kurt_returns': kurt,
+        'max_return': max_return,
+        'min_return': min_return,
+        'median_return': quantiles[0.5],
+        'rolling_std': rolling_std,
+        'mad': mad,
+        'max_min_diff': max_min_diff,
+        'var_return': var_return,
+        'expected_shortfall_return': expected_shortfall,
+        'drawdown': drawdown,
+        'proportion_positiv_ret': proportion_positive,
+        'proportion_negativ_ret': 1.0 - proportion_positive,
+        'return_25_quantile': quantiles[0.25],
+        'return_50_quantile': quantiles[0.5],
+        'return_75_quantile': quantiles[0.75],
+        **{f'avg_{h}_returns': hour_mean.reshape(n_groups, 24)[:, h] for h in range(24)},
+        **{f'std_{h}_returns': hour_std.reshape(n_groups, 24)[:, h] for h in range(24)},
+        'mean_cum_returns': mean_cum_returns,
+    }, index=pd.Index(nodes, name='settlementPoint'))
+
+    return df_features[FEATURE_COLUMNS]
+
+
+def build_feature_matrix(data_dir: str = DATA_PATH, nodes_per_chunk: int = NODES_PER_CHUNK) -> pd.DataFrame:
+    """
+    Node x feature matrix of the whole store. The nodes are processed in chunks of partitions,
+    every feature only depends on the rows of its node, so memory is bounded by the chunk.
+    :param data_dir: Folder with the virtual trading data
+    :param nodes_per_chunk: Node partitions read at a time
+    :return: Output of get_node_features for all the nodes
+    """
+    nodes = list_nodes(data_dir)
+    chunks = []
+    for start in range(0, len(nodes), nodes_per_chunk):
+        df_chunk = pd.concat([read_node(node, columns=FEATURE_INPUT_COLUMNS, data_dir=data_dir)
+                              for node in nodes[start:start + nodes_per_chunk]], ignore_index=True)
+        chunks.append(get_node_features(df_chunk))
+
+    return pd.concat(chunks)
+
+
+def get_feature_matrix(data_dir: str = DATA_PATH) -> pd.DataFrame:
+    """
+    Cached version of build_feature_matrix, rebuilt only when the source data changes
+    """
+    return load_cached_table(FEATURES_TABLE, build_feature_matrix, data_dir=data_dir)
@@ -0,0 +1,84 @@
+import argparse
+import pandas as pd
+from tqdm import tqdm
+from data_store import DATA_PATH, update_store
+from strategy import Strategy, get_node_data, get_strategy_from_metadata
+from results import Results
+from results_store import (RESULTS_PATH, latest_run, list_result_nodes, read_node_metadata, append_node_results,
+                           load_results, write_run_metrics)
+from plot_stage import PlotStage, PLOT_MODES
+from evaluate_by_node import get_performance, compute_run_metrics
+from instrumentation import stage
+
+
+def get_node_strategy(node: str, run_id: str, node_data: pd.DataFrame, results_dir: str = RESULTS_PATH) -> Strategy:
+    """
+    Rebuild the strategy a node was evaluated with from the metadata of the run
+    """
+    return get_strategy_from_metadata(read_node_metadata(node, run_id, results_dir), node_data=node_data)
+
+
+def update_node(node: str, run_id: str, plot_stage: PlotStage = None, data_dir: str = DATA_PATH,
+                results_dir: str = RESULTS_PATH) -> int:
+    """
+    Evaluate only the rows of a node that are newer than its results and append them to the run
+    :return: Number of new rows
+    """
+    state = read_node_metadata(node, run_id, results_dir).get('state') or {}
+    with stage('get_node_data', node=node):
+        node_data = get_node_data(node, data_dir=data_dir)
+    if state.get('last_date') is not None:
+        new_rows = node_data[node_data.index > pd.Timestamp(state['last_date'])]
+    else:
+        new_rows = node_data
+    if len(new_rows) == 0:
+        return 0
+
+    # The strategy keeps the whole history, the offer price of the new hours looks back at it
+    strategy = get_node_strategy(node, run_id, node_data, results_dir)
+    with stage('append_results', node=node, rows=len(new_rows)):
+        append_node_results(get_performance(new_rows, strategy), run_id, results_dir=results_dir)
+
+    if plot_stage is not None and plot_stage.dpi is not None:
+        df_node = load_results(run_id, nodes=[node], results_dir=results_dir).set_index('date')
+        plot_stage.submit(Results(df_node))
+
+    return len(new_rows)
+
+
+def update_run(run_id: str = None, plot_mode: str = 'off', plot_workers: int = 2, data_dir: str = DATA_PATH,
+               results_dir: str = RESULTS_PATH) -> dict:
+    """
+    Incremental daily update: ingest the rows appended to the CSV and evaluate only those rows
+    for every node of the run, appending them to the existing results
+    :param run_id: Identifier of the run, the latest run by default
+    :param plot_mode: One of PLOT_MODES, the plots of the updated nodes are rendered again
+    :param plot_workers: Background processes rendering the plots
+    :param data_dir: Folder with the virtual trading data
+    :param results_dir: Folder of the results store
+    :return: Dict with the number of new rows of each updated node
+    """
+    run_id = run_id or latest_run(results_dir)
+    update_store(data_dir)
+
+    new_rows = {}
+    with PlotStage(plot_mode, n_workers=plot_workers) as plot_stage:
+        for node in tqdm(list_result_nodes(run_id, results_dir)):
+            n_rows = update_node(node, run_id, plot_stage, data_dir=data_dir, results_dir=results_dir)
+            if n_rows > 0:
+                new_rows[node] = n_rows
+
+    if len(new_rows) > 0:
+        df_metrics = compute_run_metrics(run_id, results_dir)
+        write_run_metrics(run_id, df_metrics, results_dir=results_dir)
+
+    return new_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the new rows of the virtual trading data")
+    parser.add_argument("--run-id", default=None, help="Run to update, the latest run by default")
+    parser.add_argument("--plots", choices=list(PLOT_MODES), default="off", help="Plot mode")
+    args = parser.parse_args()
+    updated = update_run(args.run_id, plot_mode=args.plots)
+    print(f"{len(updated)} nodes updated, {sum(updated.values())} new rows")
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import argparse
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+import pandas as pd
+
+FILE_PATH = os.path.dirname(__file__)
+PROFILES_PATH = os.path.join(os.path.dirname(FILE_PATH), 'results', 'profiles')
+
+# Read from the environment, so the worker processes of a run record their stages too
+INSTRUMENT_ENV = 'ERCOT_INSTRUMENT'                # JSON lines file of the stage records
+INSTRUMENT_MEMORY_ENV = 'ERCOT_INSTRUMENT_MEMORY'  # '1' to trace the peak memory of the stages
+PROFILE_NODE_ENV = 'ERCOT_PROFILE_NODE'            # Node evaluated under cProfile
+PROFILE_DIR_ENV = 'ERCOT_PROFILE_DIR'              # Folder of the .prof files, PROFILES_PATH by default
+
+_NULL_STAGE = nullcontext()
+_state = {'path': None, 'memory': False, 'file': None, 'file_pid': None, 'stack': [], 'stack_pid': None}
+
+
+def configure():
+    """
+    (Re)read the instrumentation settings from the environment
+    """
+    _state['path'] = os.environ.get(INSTRUMENT_ENV) or None
+    _state['memory'] = os.environ.get(INSTRUMENT_MEMORY_ENV) == '1'
+
+
+def enable(path: str, memory: bool = False, profile_node: str = None, profile_dir: str = None):
+    """
+    Record the stages of this process and of the processes it starts
+    :param path: JSON lines file, records are appended. None to only profile a node
+    :param memory: Also trace the peak memory of every stage, slower
+    :param profile_node: Optional node evaluated under cProfile
+    :param profile_dir: Folder of the .prof files
+    """
+    if path is not None:
+        os.environ[INSTRUMENT_ENV] = path
+    os.environ[INSTRUMENT_MEMORY_ENV] = '1' if memory else '0'
+    if profile_node is not None:
+        os.environ[PROFILE_NODE_ENV] = profile_node
+    if profile_dir is not None:
+        os.environ[PROFILE_DIR_ENV] = profile_dir
+    configure()
+
+
+def disable():
+    for env in [INSTRUMENT_ENV, INSTRUMENT_MEMORY_ENV, PROFILE_NODE_ENV, PROFILE_DIR_ENV]:
+        os.environ.pop(env, None)
+    configure()
+
+
+def is_enabled() -> bool:
+    return _state['path'] is not None
+
+
+def _write(record: dict):
+    # One file handle per process, each record is a single appended line
+    if _state['file'] is None or _state['file_pid'] != os.getpid():
+        os.makedirs(os.path.dirname(os.path.abspath(_state['path'])), exist_ok=True)
+        _state['file'] = open(_state['path'], 'a', buffering=1)
+        _state['file_pid'] = os.getpid()
+    _state['file'].write(json.dumps(record) + '\n')
+
+
+@contextmanager
+def _record_stage(name: str, fields: dict):
+    if _state['stack_pid'] != os.getpid():
+        # A forked worker does not continue the stages of its parent
+        _state['stack'], _state['stack_pid'] = [], os.getpid()
+    stack = _state['stack']
+    trace_memory = _state['memory']
+    if trace_memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            # The peak of the parent stage so far, before it is reset for this stage
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+    frame = {'name': name, 'peak': 0, 'start_memory': current if trace_memory else 0}
+    stack.append(frame)
+
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        stack.pop()
+        record = {'stage': name, **fields, 'wall_s': round(wall, 6), 'cpu_s': round(cpu, 6),
+                  'parent': stack[-1]['name'] if stack else None, 'pid': os.getpid(), 'time': time.time()}
+        if trace_memory:
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            record['peak_mb'] = round((peak - frame['start_memory']) / 2 ** 20, 3)
+        if error is not None:
+            record['error'] = error
+        _write(record)
+
+
+def stage(name: str, **fields):
+    """
+    Context manager that records the wall time, CPU time and (optionally) the peak memory of a
+    stage as a JSON line. When the instrumentation is off it is a shared no-op context.
+    :param name: Name of the stage
+    :param fields: Extra fields of the record, e.g. node
+    """
+    if _state['path'] is None:
+        return _NULL_STAGE
+    return _record_stage(name, fields)
+
+
+@contextmanager
+def profile_node(node: str):
+    """
+    Run a block under cProfile when node is the node selected with ERCOT_PROFILE_NODE.
+    The stats are saved as <node>.prof (for snakeviz, gprof2dot or flameprof) and as a text
+    report of the top functions by cumulative time.
+    """
+    if os.environ.get(PROFILE_NODE_ENV) != node:
+        yield
+        return
+
+    profile_dir = os.environ.get(PROFILE_DIR_ENV) or PROFILES_PATH
+    os.makedirs(profile_dir, exist_ok=True)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(profile_dir, f'{node}.prof'))
+        with open(os.path.join(profile_dir, f'{node}.txt'), 'w') as f:
+            pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(40)
+
+
+def read_records(path: str) -> pd.DataFrame:
+    return pd.read_json(path, lines=True)
+
+
+def summarize(path: str) -> pd.DataFrame:
+    """
+    Totals of every stage of a JSON lines file, slowest first
+    """
+    records = read_records(path)
+    aggregations = {'count': ('wall_s', 'size'), 'wall_s': ('wall_s', 'sum'), 'mean_wall_s': ('wall_s', 'mean'),
+                    'max_wall_s': ('wall_s', 'max'), 'cpu_s': ('cpu_s', 'sum')}
+    if 'peak_mb' in records:
+        aggregations['max_peak_mb'] = ('peak_mb', 'max')
+    return records.groupby('stage').agg(**aggregations).sort_values('wall_s', ascending=False)
+
+
+def slowest_nodes(path: str, stage_name: str = 'evaluate_node', n: int = 10) -> pd.DataFrame:
+    records = read_records(path)
+    if 'node' not in records:
+        return pd.DataFrame(columns=['node', 'wall_s', 'cpu_s'])
+    return records[records['stage'] == stage_name].nlargest(n, 'wall_s')[['node', 'wall_s', 'cpu_s']]
+
+
+configure()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summary of the stage records of a run")
+    parser.add_argument("path", help="JSON lines file written with ERCOT_INSTRUMENT")
+    parser.add_argument("--nodes", type=int, default=10, help="Number of slowest nodes to show")
+    args = parser.parse_args()
+    with pd.option_context('display.width', 200):
+        print(summarize(args.path).to_string(float_format='{:,.3f}'.format))
+        print()
+        print(slowest_nodes(args.path, n=args.nodes).to_string(index=False, float_format='{:,.3f}'.format))
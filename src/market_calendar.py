@@ -0,0 +1,74 @@
+import calendar
+import numpy as np
+import pandas as pd
+from data_store import DATA_PATH, read_timestamps, load_cached_table, source_signature
+from utils import TEXAS_SEASON_BY_MONTH
+
+CALENDAR_TABLE = 'calendar'
+
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+MONTH_NAMES = list(calendar.month_name)[1:]
+QUARTER_SEASONS = ['Winter', 'Spring', 'Summer', 'Fall']
+TEXAS_SEASONS = list(dict.fromkeys(TEXAS_SEASON_BY_MONTH))
+
+# Month -> season code lookups, index 0 is January
+QUARTER_SEASON_CODE_BY_MONTH = np.arange(12) // 3
+TEXAS_SEASON_CODE_BY_MONTH = np.array([TEXAS_SEASONS.index(season) for season in TEXAS_SEASON_BY_MONTH])
+
+_calendars = {}
+
+
+def _categorical(codes: np.ndarray, categories: list) -> pd.Categorical:
+    return pd.Categorical.from_codes(codes, categories=categories, ordered=True)
+
+
+def build_calendar_from_index(index: pd.DatetimeIndex) -> pd.DataFrame:
+    """
+    Calendar fields of every timestamp, as small integer or categorical columns
+    :param index: Unique timestamps
+    :return: DataFrame indexed by date with day_of_week, hour_ending, month_name, season and texas_season
+    """
+    month_idx = index.month.to_numpy() - 1
+    return pd.DataFrame({
+        'day_of_week': _categorical(index.dayofweek.to_numpy(), DAYS_OF_WEEK),
+        'hour_ending': (index.hour.to_numpy() + 1).astype(np.int8),
+        'month_name': _categorical(month_idx, MONTH_NAMES),
+        'season': _categorical(QUARTER_SEASON_CODE_BY_MONTH[month_idx], QUARTER_SEASONS),
+        'texas_season': _categorical(TEXAS_SEASON_CODE_BY_MONTH[month_idx], TEXAS_SEASONS),
+    }, index=index.rename('date'))
+
+
+def build_calendar(data_dir: str = DATA_PATH) -> pd.DataFrame:
+    """
+    Calendar over the union of the timestamps of all the nodes
+    """
+    return build_calendar_from_index(read_timestamps(data_dir))
+
+
+def get_calendar(data_dir: str = DATA_PATH) -> pd.DataFrame:
+    """
+    Shared calendar table, built once per version of the source data and kept in memory
+    """
+    key = (data_dir, tuple(source_signature(data_dir).items()))
+    if key not in _calendars:
+        _calendars.clear()
+        _calendars[key] = load_cached_table(CALENDAR_TABLE, build_calendar, data_dir=data_dir)
+    return _calendars[key]
+
+
+def get_calendar_fields(index: pd.DatetimeIndex, columns: list = None, data_dir: str = DATA_PATH) -> pd.DataFrame:
+    """
+    Calendar fields of the given dates, looked up in the shared calendar
+    :param index: Dates of a node
+    :param columns: Optional subset of calendar columns
+    :param data_dir: Folder with the virtual trading data
+    :return: DataFrame aligned with the index
+    """
+    shared_calendar = get_calendar(data_dir)
+    if columns is not None:
+        shared_calendar = shared_calendar[columns]
+    fields = shared_calendar.reindex(index)
+    if fields.isna().any().any():
+        # Dates that are not in the store, e.g. a frame built by hand
+        fields = build_calendar_from_index(index)[shared_calendar.columns]
+    return fields
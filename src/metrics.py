@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+METRIC_COLUMNS = ['total_profit', 'total_losses', 'hours_awarded', 'average_return', 'roi',
+                  'sharpe_ratio', 'max_drawdown', 'win_rate', 'daily_skew']
+
+
+def to_matrices(df_results: pd.DataFrame, columns: list = None) -> dict:
+    """
+    Pivot long results (one row per node and hour) into date x node matrices
+    :param df_results: DataFrame with date, settlementPoint and the value columns
+    :param columns: Value columns to pivot, profit, awarded, SPP_DA and return_DA_RT by default
+    :return: Dict of column name to DataFrame indexed by date with one column per node
+    """
+    columns = columns or ['profit', 'awarded', 'SPP_DA', 'return_DA_RT']
+    wide = df_results.pivot(index='date', columns='settlementPoint', values=columns)
+    return {column: wide[column] for column in columns}
+
+
+def get_max_drawdown(profit: np.ndarray, axis: int = -1) -> np.ndarray:
+    """
+    Maximum drop of the cumulative profit from its running maximum (starting at 0)
+    """
+    cum_profit = np.cumsum(profit, axis=axis)
+    running_max = np.maximum(np.maximum.accumulate(cum_profit, axis=axis), 0)
+    return (running_max - cum_profit).max(axis=axis, initial=0)
+
+
+def get_daily_skew(returns: pd.DataFrame) -> pd.Series:
+    """
+    Skew of the daily sum of returns of every node, over the days each node has data
+    :param returns: DataFrame indexed by date with one column per node
+    """
+    daily = returns.resample('D').sum(min_count=1)
+    has_rows = returns.notna().resample('D').sum() > 0
+    # Days with no rows inside the history of a node sum 0, like a resample of the node alone
+    in_history = has_rows.cummax() & has_rows[::-1].cummax()[::-1]
+    return daily.fillna(0).where(in_history).skew()
+
+
+def compute_metrics(profit: pd.DataFrame, awarded: pd.DataFrame, spp_da: pd.DataFrame,
+                    returns: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    Performance metrics of all the nodes at once
+    :param profit: Hourly profit, DataFrame indexed by date with one column per node
+    :param awarded: Hourly awarded flag (0 or 1), same shape as profit
+    :param spp_da: Hourly DA price, same shape as profit
+    :param returns: Optional hourly return_DA_RT for the daily skew, same shape as profit
+    :return: DataFrame indexed by node with the METRIC_COLUMNS
+    """
+    profit_values = profit.to_numpy(dtype=float)
+    awarded_values = np.nan_to_num(awarded.to_numpy(dtype=float)) == 1
+    spp_da_values = spp_da.to_numpy(dtype=float)
+
+    total_profit = np.nansum(profit_values, axis=0)
+    n_profit = (~np.isnan(profit_values)).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average_return = total_profit / n_profit
+        std_return = np.nanstd(profit_values, axis=0, ddof=1)
+        roi = total_profit / np.where(awarded_values, spp_da_values, 0).sum(axis=0)
+        win_rate = (awarded_values & (profit_values > 0)).sum(axis=0) / awarded_values.sum(axis=0)
+        sharpe_ratio = average_return / std_return
+
+    df_metrics = pd.DataFrame({
+        'total_profit': total_profit,
+        'total_losses': np.where(profit_values < 0, profit_values, 0).sum(axis=0),
+        'hours_awarded': awarded_values.sum(axis=0),
+        'average_return': average_return,
+        'roi': roi,
+        'sharpe_ratio': sharpe_ratio,
+        'max_drawdown': get_max_drawdown(np.nan_to_num(profit_values), axis=0),
+        'win_rate': win_rate,
+        'daily_skew': get_daily_skew(returns).to_numpy() if returns is not None else np.nan,
+    }, index=profit.columns)
+    df_metrics.index.name = 'settlementPoint'
+
+    return df_metrics
+
+
+def compute_results_metrics(df_results: pd.DataFrame) -> pd.DataFrame:
+    """
+    compute_metrics from long results, e.g. results_store.load_results
+    """
+    matrices = to_matrices(df_results)
+    return compute_metrics(matrices['profit'], matrices['awarded'], matrices['SPP_DA'], matrices['return_DA_RT'])
@@ -0,0 +1,100 @@
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+from results import Results, PLOT_COLUMNS
+from instrumentation import stage
+
+# dpi of each plot mode, no plots when off
+PLOT_MODES = {'off': None, 'preview': 72, 'full': 300}
+
+
+def init_worker():
+    # Initializer of the worker processes, they render the plots without a display
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def get_hash_path(image_path: str) -> str:
+    return image_path + '.json'
+
+
+def is_plot_current(image_path: str, plot_hash: str) -> bool:
+    hash_path = get_hash_path(image_path)
+    if not os.path.exists(image_path) or not os.path.exists(hash_path):
+        return False
+    with open(hash_path) as f:
+        return json.load(f).get('hash') == plot_hash
+
+
+def render_plot(results: Results, image_path: str, dpi: int, plot_hash: str):
+    """
+    Render the plot of a node and record the hash of its content next to the image
+    """
+    with stage('render_plot', node=results.spp_name, dpi=dpi):
+        results.generate_plot(dpi=dpi, image_path=image_path)
+    with open(get_hash_path(image_path), 'w') as f:
+        json.dump({'hash': plot_hash, 'dpi': dpi}, f)
+
+
+class PlotStage:
+    """
+    Optional plot stage of the evaluation.
+    Plots are rendered in background processes when n_workers > 0 (synchronously otherwise),
+    and skipped when the image of the node already shows the same results.
+    """
+    def __init__(self, mode: str = 'full', n_workers: int = 0):
+        if mode not in PLOT_MODES:
+            raise ValueError(f"mode must be one of {list(PLOT_MODES)}, got {mode}")
+        self.mode = mode
+        self.dpi = PLOT_MODES[mode]
+        self.n_workers = n_workers
+        self.executor = None
+        self.futures = {}
+
+    def submit(self, results: Results):
+        """
+        Schedule the plot of a node
+        :param results: Results of the node
+        :return: True if the plot is rendered or scheduled, False if it is off or up to date
+        """
+        if self.dpi is None:
+            return False
+
+        image_path = results.get_image_path()
+        plot_hash = f"{results.content_hash()}-{self.dpi}"
+        if is_plot_current(image_path, plot_hash):
+            return False
+
+        # Only the plotted columns are sent to the workers
+        plot_results = Results(results.df[PLOT_COLUMNS].copy())
+        if self.n_workers == 0:
+            render_plot(plot_results, image_path, self.dpi, plot_hash)
+            return True
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.n_workers, initializer=init_worker)
+        self.futures[results.spp_name] = self.executor.submit(render_plot, plot_results, image_path, self.dpi, plot_hash)
+        return True
+
+    def wait(self) -> dict:
+        """
+        Wait for the scheduled plots
+        :return: Dict with the error of the plots that failed
+        """
+        errors = {}
+        for spp_name, future in self.futures.items():
+            error = future.exception()
+            if error is not None:
+                errors[spp_name] = repr(error)
+        self.futures = {}
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+        return errors
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wait()
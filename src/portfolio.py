@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+from scipy import optimize
+from results_store import RESULTS_PATH, load_results, read_run_metrics, latest_run
+from evaluate_by_node import compute_run_metrics
+
+RETURN_COLUMNS = ['date', 'settlementPoint', 'SPP_DA', 'awarded', 'profit']
+
+
+def get_profitable_nodes(run_id: str = None, results_dir: str = RESULTS_PATH) -> list:
+    """
+    Nodes of a run with a positive total profit, from the saved metrics of the run when there are any
+    :param run_id: Identifier of the run, the latest run by default
+    :param results_dir: Folder of the results store
+    :return: List of nodes
+    """
+    run_id = run_id or latest_run(results_dir)
+    df_metrics = read_run_metrics(run_id, results_dir)
+    if df_metrics is None:
+        df_metrics = compute_run_metrics(run_id, results_dir)
+    return df_metrics.index[df_metrics['total_profit'] > 0].tolist()
+
+
+def get_return_matrices(run_id: str = None, nodes: list = None, results_dir: str = RESULTS_PATH) -> dict:
+    """
+    Hourly profit and percentage return of the nodes of a run, as date x node matrices
+    :param run_id: Identifier of the run, the latest run by default
+    :param nodes: Optional list of nodes, all the profitable nodes of the run by default
+    :param results_dir: Folder of the results store
+    :return: Dict with the 'profit' and 'profit_perc' DataFrames
+    """
+    run_id = run_id or latest_run(results_dir)
+    if nodes is None:
+        nodes = get_profitable_nodes(run_id, results_dir)
+    df_results = load_results(run_id, nodes=nodes, columns=RETURN_COLUMNS, results_dir=results_dir)
+
+    cost = df_results["SPP_DA"] * df_results["awarded"]
+    # When the cost is 0 the percentage return is 0
+    df_results = df_results.assign(profit_perc=np.where(cost == 0, 0, df_results["profit"] / cost.where(cost != 0)))
+
+    return {
+        'profit': df_results.pivot(index='date', columns='settlementPoint', values='profit'),
+        'profit_perc': df_results.pivot(index='date', columns='settlementPoint', values='profit_perc'),
+    }
+
+
+def get_mean_cov(returns: pd.DataFrame):
+    """
+    Expected return and covariance of the nodes, computed once for all the portfolios
+    :param returns: DataFrame indexed by date with one column per node
+    :return: Tuple with the mean vector and the covariance matrix as numpy arrays
+    """
+    return returns.mean().to_numpy(), returns.cov().to_numpy()
+
+
+def get_portfolio_stats(weights: np.ndarray, mean_returns: np.ndarray, cov_returns: np.ndarray):
+    """
+    Return, volatility and Sharpe ratio of a batch of portfolios
+    :param weights: Array of shape (n_portfolios, n_nodes)
+    :return: Tuple of arrays of shape (n_portfolios,)
+    """
+    returns = weights @ mean_returns
+    volatility = np.sqrt(np.einsum('ij,jk,ik->i', weights, cov_returns, weights))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sharpe_ratio = returns / volatility
+
+    return returns, volatility, sharpe_ratio
+
+
+def monte_carlo(mean_returns: np.ndarray, cov_returns: np.ndarray, n: int = 50_000,
+                batch_size: int = 10_000, seed: int = None):
+    """
+    Random long only portfolios, evaluated in batches with matrix products
+    :param mean_returns: Output of get_mean_cov
+    :param cov_returns: Output of get_mean_cov
+    :param n: Number of portfolios
+    :param batch_size: Number of portfolios evaluated at once
+    :param seed: Optional seed of the random generator
+    :return: Tuple with the weights (n, n_nodes), returns, volatility and Sharpe ratio
+    """
+    rng = np.random.default_rng(seed)
+    weights = np.zeros(shape=(n, len(mean_returns)))
+    returns = np.zeros(n)
+    volatility = np.zeros(n)
+    sharpe_ratio = np.zeros(n)
+
+    for start in range(0, n, batch_size):
+        end = min(start + batch_size, n)
+        # Random normalized weights
+        w = rng.random((end - start, len(mean_returns)))
+        w = w / w.sum(axis=1, keepdims=True)
+        weights[start:end] = w
+        returns[start:end], volatility[start:end], sharpe_ratio[start:end] = get_portfolio_stats(w, mean_returns, cov_returns)
+
+    return weights, returns, volatility, sharpe_ratio
+
+
+def _long_only_constraints(n_nodes: int):
+    bounds = tuple((0, 1) for _ in range(n_nodes))
+    constraints = [{'type': 'eq', 'fun': lambda w: np.sum(w) - 1, 'jac': lambda w: np.ones_like(w)}]
+    return bounds, constraints
+
+
+def max_sharpe_weights(mean_returns: np.ndarray, cov_returns: np.ndarray) -> np.ndarray:
+    """
+    Long only weights with the maximum Sharpe ratio, solved with SLSQP and analytic gradients
+    :param mean_returns: Output of get_mean_cov
+    :param cov_returns: Output of get_mean_cov
+    :return: Array of weights that sum 1
+    """
+    n_nodes = len(mean_returns)
+
+    def neg_sharpe(w):
+        ret = w @ mean_returns
+        cov_w = cov_returns @ w
+        vol = np.sqrt(w @ cov_w)
+        grad = -(mean_returns * vol - ret * cov_w / vol) / vol ** 2
+        return -ret / vol, grad
+
+    bounds, constraints = _long_only_constraints(n_nodes)
+    init_guess = np.full(n_nodes, 1 / n_nodes)
+    opt_results = optimize.minimize(neg_sharpe, init_guess, jac=True, method='SLSQP',
+                                    bounds=bounds, constraints=constraints)
+
+    return opt_results.x
+
+
+def efficient_frontier(mean_returns: np.ndarray, cov_returns: np.ndarray, n_points: int = 100) -> pd.DataFrame:
+    """
+    Minimum volatility long only portfolio for a range of target returns
+    :param mean_returns: Output of get_mean_cov
+    :param cov_returns: Output of get_mean_cov
+    :param n_points: Number of target returns between the lowest and the highest node return
+    :return: DataFrame with the return, volatility and weights of each point of the frontier
+    """
+    n_nodes = len(mean_returns)
+    bounds, constraints = _long_only_constraints(n_nodes)
+    init_guess = np.full(n_nodes, 1 / n_nodes)
+
+    def variance(w):
+        cov_w = cov_returns @ w
+        return w @ cov_w, 2 * cov_w
+
+    frontier = []
+    for target_return in np.linspace(mean_returns.min(), mean_returns.max(), n_points):
+        target_constraint = {'type': 'eq', 'fun': lambda w, r=target_return: w @ mean_returns - r,
+                             'jac': lambda w: mean_returns}
+        result = optimize.minimize(variance, init_guess, jac=True, method='SLSQP', bounds=bounds,
+                                   constraints=constraints + [target_constraint])
+        if result.success:
+            frontier.append({'return': target_return, 'volatility': np.sqrt(result.fun), 'weights': result.x})
+
+    return pd.DataFrame(frontier)
+
+
+def get_portfolio_profit(profit: pd.DataFrame, weights: np.ndarray) -> pd.Series:
+    """
+    Cumulative profit of the weighted portfolio
+    :param profit: DataFrame indexed by date with one column per node
+    :param weights: Weights of the nodes, in the order of the columns
+    """
+    return pd.Series(profit.fillna(0).to_numpy() @ weights, index=profit.index).cumsum()
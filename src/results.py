@@ -1,24 +1,43 @@
 import os
+import hashlib
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
-from os.path import join
+from results_store import DEFAULT_RUN_ID, RESULTS_PATH, write_node_results, get_image_path
+from metrics import compute_results_metrics, get_daily_skew
 
 
-class Results:
-    __FILE_PATH__ = os.path.dirname(__file__)
+# Columns used by generate_plot
+PLOT_COLUMNS = ['settlementPoint', 'profit', 'awarded', 'return_DA_RT', 'SPP_DA', 'SPP_RT']
+
 
-    def __init__(self, df: pd.DataFrame):
+class Results:
+    def __init__(self, df: pd.DataFrame, rules: list = None, run_id: str = DEFAULT_RUN_ID, params: dict = None,
+                 results_dir: str = RESULTS_PATH):
         self.df = df
         self.spp_name = df['settlementPoint'].unique()[0]
+        self.rules = rules or []
+        self.run_id = run_id
+        self.params = params
+        self.results_dir = results_dir
 
     def save_results(self):
-        parent_folder = os.path.dirname(self.__FILE_PATH__)
-        self.df.to_csv(join(parent_folder, 'results', 'csv', f'{self.spp_name}_results.csv'))
+        # Typed columns in the results store, the rules are saved once as metadata of the node
+        write_node_results(self.df, self.run_id, self.rules, params=self.params, results_dir=self.results_dir)
 
-    def generate_plot(self):
-        parent_folder = os.path.dirname(self.__FILE_PATH__)
+    def get_image_path(self) -> str:
+        # Each run keeps its own images and plot hashes
+        return get_image_path(self.run_id, self.spp_name, self.results_dir)
+
+    def content_hash(self) -> str:
+        """
+        Hash of the data shown in the plot, the image only changes when the hash changes
+        """
+        hashes = pd.util.hash_pandas_object(self.df[PLOT_COLUMNS], index=True).values
+        return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+    def generate_plot(self, dpi: int = 300, image_path: str = None):
 
         fig, ax = plt.subplot_mosaic([['profit', 'mw'], ['SPP', 'SPP']], figsize=(12, 8), tight_layout=True)
         self.df["cum_profit"] = self.df["profit"].cumsum()
@@ -30,7 +49,7 @@ class Results:
         ax['profit'].get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
 
         # Histograma de la suma de los retornos, incluyendo los negativos
-        skew = self.df[['return_DA_RT']].resample('D').sum().skew().values[0]
+        skew = get_daily_skew(self.df[['return_DA_RT']]).values[0]
         df_no_outliers = self.df[["return_DA_RT"]].resample('D').sum()
         df_no_outliers = df_no_outliers[np.abs(df_no_outliers['return_DA_RT'] - df_no_outliers['return_DA_RT'].mean()) <= (3 * df_no_outliers['return_DA_RT'].std())]
         df_no_outliers.hist(
@@ -56,22 +75,24 @@ class Results:
         ax['SPP'].set_ylabel('USD')
 
         plt.suptitle(f"{self.spp_name}")
-        plt.savefig(join(parent_folder, 'results', 'img', f'{self.spp_name}_results.png'), dpi=300, bbox_inches='tight')
+        image_path = image_path or self.get_image_path()
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        plt.savefig(image_path, dpi=dpi, bbox_inches='tight')
         plt.close()
 
+    def get_metrics(self) -> pd.Series:
+        df_wide = self.df.rename_axis('date').reset_index()
+        return compute_results_metrics(df_wide).loc[self.spp_name]
+
     def __str__(self):
+        metrics = self.get_metrics()
         str_results = f"Results for node {self.spp_name}:\n"
-        #rules = self.df['rules'].unique()
+        #rules = ' & '.join([str(rule) for rule in self.rules])
         #str_results += f"\tRules: {rules}\n"
-        total_return = self.df['profit'].sum()
-        str_results += f"\tTotal profit: USD {total_return:,.2f}\n"
-        total_losses = self.df[self.df['profit'] < 0]['profit'].sum()
-        str_results += f"\tTotal losses: USD {total_losses:,.2f}\n"
-        n_hours_awarded = self.df['awarded'].sum()
-        str_results += f"\tTotal hours awarded: {n_hours_awarded}\n"
-        average_return = self.df['profit'].mean()
-        roi = total_return / self.df[self.df.awarded == 1]['SPP_DA'].sum()
-        str_results += f"\tAverage return: USD {average_return:,.2f}\n"
-        str_results += f"\tROI: {roi*100:.2f}%\n"
+        str_results += f"\tTotal profit: USD {metrics['total_profit']:,.2f}\n"
+        str_results += f"\tTotal losses: USD {metrics['total_losses']:,.2f}\n"
+        str_results += f"\tTotal hours awarded: {int(metrics['hours_awarded'])}\n"
+        str_results += f"\tAverage return: USD {metrics['average_return']:,.2f}\n"
+        str_results += f"\tROI: {metrics['roi']*100:.2f}%\n"
 
         return str_results
@@ -0,0 +1,201 @@
+import os
+import json
+import shutil
+from datetime import datetime
+import pandas as pd
+
+FILE_PATH = os.path.dirname(__file__)
+RESULTS_PATH = os.path.join(os.path.dirname(FILE_PATH), 'results', 'store')
+
+DEFAULT_RUN_ID = 'default'
+RUN_METADATA_FILE = '_run.json'
+RUN_METRICS_FILE = '_metrics.csv'
+NODE_METADATA_FILE = '_node.json'
+# Plots of the nodes of a run, next to their results
+IMAGES_FOLDER = 'img'
+
+# Typed columns kept for every hour, anything else (rules, calendar strings) is not stored per row
+RESULT_COLUMNS = {
+    'date': 'datetime64[us]',
+    'settlementPoint': 'category',
+    'SPP_DA': 'float64',
+    'SPP_RT': 'float64',
+    'return_DA_RT': 'float64',
+    'bid_price': 'float64',
+    'awarded': 'int8',
+    'profit': 'float64',
+}
+
+
+def new_run_id() -> str:
+    return datetime.now().strftime('%Y%m%dT%H%M%S')
+
+
+def get_run_path(run_id: str, results_dir: str = RESULTS_PATH) -> str:
+    return os.path.join(results_dir, f'run_id={run_id}')
+
+
+def get_node_path(run_id: str, settlement_point_name: str, results_dir: str = RESULTS_PATH) -> str:
+    return os.path.join(get_run_path(run_id, results_dir), f'settlementPoint={settlement_point_name}')
+
+
+def get_image_path(run_id: str, settlement_point_name: str, results_dir: str = RESULTS_PATH) -> str:
+    return os.path.join(get_run_path(run_id, results_dir), IMAGES_FOLDER, f'{settlement_point_name}_results.png')
+
+
+def write_run_metadata(run_id: str, params: dict, results_dir: str = RESULTS_PATH):
+    """
+    Save the parameters shared by all the nodes of a run
+    """
+    run_path = get_run_path(run_id, results_dir)
+    os.makedirs(run_path, exist_ok=True)
+    with open(os.path.join(run_path, RUN_METADATA_FILE), 'w') as f:
+        json.dump(params, f, indent=2)
+
+
+def write_run_metrics(run_id: str, df_metrics: pd.DataFrame, results_dir: str = RESULTS_PATH):
+    """
+    Save the summary metrics of all the nodes of a run
+    """
+    df_metrics.to_csv(os.path.join(get_run_path(run_id, results_dir), RUN_METRICS_FILE))
+
+
+def read_run_metrics(run_id: str = None, results_dir: str = RESULTS_PATH) -> pd.DataFrame:
+    """
+    Summary metrics saved by write_run_metrics
+    :return: DataFrame indexed by settlementPoint, None when the run has no saved metrics
+    """
+    metrics_path = os.path.join(get_run_path(run_id or latest_run(results_dir), results_dir), RUN_METRICS_FILE)
+    if not os.path.exists(metrics_path):
+        return None
+    return pd.read_csv(metrics_path, index_col='settlementPoint')
+
+
+def write_node_results(df: pd.DataFrame, run_id: str, rules: list, params: dict = None,
+                       results_dir: str = RESULTS_PATH):
+    """
+    Save the hourly results of a node as a Parquet partition of the run.
+    The rules and the strategy parameters are stored once in the node metadata.
+    :param df: Output of evaluate_performance, with a date index
+    :param run_id: Identifier of the run
+    :param rules: Rules of the strategy
+    :param params: Optional strategy parameters
+    :param results_dir: Folder of the results store
+    """
+    settlement_point_name = df['settlementPoint'].iloc[0]
+    node_path = get_node_path(run_id, settlement_point_name, results_dir)
+    # A node is written by a single process, replace any previous result
+    shutil.rmtree(node_path, ignore_errors=True)
+    os.makedirs(node_path)
+
+    df_results = df.reset_index()[list(RESULT_COLUMNS)].astype(RESULT_COLUMNS)
+    df_results.to_parquet(os.path.join(node_path, 'part-00000.parquet'), index=False)
+
+    metadata = {
+        'settlementPoint': settlement_point_name,
+        'rules': [str(rule) for rule in rules],
+        'time_based_rules': [
+            {'day_of_week': rule.day_of_week, 'hour_range': [int(h) for h in rule.hour_range], 'season': rule.season}
+            for rule in rules
+        ],
+        'params': params or {},
+        'state': get_results_state(df_results),
+    }
+    with open(os.path.join(node_path, NODE_METADATA_FILE), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+
+def get_results_state(df_results: pd.DataFrame, state: dict = None) -> dict:
+    """
+    Running totals of the results of a node, carried forward by the incremental updates
+    :param df_results: New results, with a date column
+    :param state: Optional state of the previous results
+    :return: Dict with the last date, number of rows, cumulative profit and awarded MW
+    """
+    state = state or {'last_date': None, 'rows': 0, 'cum_profit': 0.0, 'mw': 0}
+    last_date = df_results['date'].max() if len(df_results) else None
+    if state['last_date'] is not None and (last_date is None or str(last_date) < state['last_date']):
+        last_date = state['last_date']
+    return {
+        'last_date': str(last_date) if last_date is not None else None,
+        'rows': state['rows'] + len(df_results),
+        'cum_profit': state['cum_profit'] + float(df_results['profit'].sum()),
+        'mw': state['mw'] + int(df_results['awarded'].sum()),
+    }
+
+
+def append_node_results(df: pd.DataFrame, run_id: str, results_dir: str = RESULTS_PATH) -> dict:
+    """
+    Add new hourly results of a node to a run, as a new part of its partition
+    :param df: Output of evaluate_performance for the new rows only, with a date index
+    :param run_id: Identifier of the run
+    :param results_dir: Folder of the results store
+    :return: Updated state of the node
+    """
+    settlement_point_name = df['settlementPoint'].iloc[0]
+    node_path = get_node_path(run_id, settlement_point_name, results_dir)
+    metadata = read_node_metadata(settlement_point_name, run_id, results_dir)
+
+    df_results = df.reset_index()[list(RESULT_COLUMNS)].astype(RESULT_COLUMNS)
+    n_parts = len([part for part in os.listdir(node_path) if part.endswith('.parquet')])
+    df_results.to_parquet(os.path.join(node_path, f'part-{n_parts:05d}.parquet'), index=False)
+
+    metadata['state'] = get_results_state(df_results, metadata.get('state'))
+    with open(os.path.join(node_path, NODE_METADATA_FILE), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+    return metadata['state']
+
+
+def list_runs(results_dir: str = RESULTS_PATH) -> list:
+    if not os.path.exists(results_dir):
+        return []
+    return sorted(folder.split('=', 1)[1] for folder in os.listdir(results_dir) if folder.startswith('run_id='))
+
+
+def latest_run(results_dir: str = RESULTS_PATH) -> str:
+    """
+    Most recent run, run ids are timestamps so they sort chronologically
+    """
+    runs = [run_id for run_id in list_runs(results_dir) if run_id != DEFAULT_RUN_ID]
+    return runs[-1] if runs else DEFAULT_RUN_ID
+
+
+def list_result_nodes(run_id: str = None, results_dir: str = RESULTS_PATH) -> list:
+    run_path = get_run_path(run_id or latest_run(results_dir), results_dir)
+    return sorted(folder.split('=', 1)[1] for folder in os.listdir(run_path) if folder.startswith('settlementPoint='))
+
+
+def read_run_metadata(run_id: str = None, results_dir: str = RESULTS_PATH) -> dict:
+    metadata_path = os.path.join(get_run_path(run_id or latest_run(results_dir), results_dir), RUN_METADATA_FILE)
+    if not os.path.exists(metadata_path):
+        return {}
+    with open(metadata_path) as f:
+        return json.load(f)
+
+
+def read_node_metadata(settlement_point_name: str, run_id: str = None, results_dir: str = RESULTS_PATH) -> dict:
+    node_path = get_node_path(run_id or latest_run(results_dir), settlement_point_name, results_dir)
+    with open(os.path.join(node_path, NODE_METADATA_FILE)) as f:
+        return json.load(f)
+
+
+def load_results(run_id: str = None, nodes: list = None, columns: list = None,
+                 results_dir: str = RESULTS_PATH) -> pd.DataFrame:
+    """
+    Load the results of a run, reading only the requested nodes and columns
+    :param run_id: Identifier of the run, the latest run by default
+    :param nodes: Optional list of nodes, all the nodes of the run by default
+    :param columns: Optional subset of RESULT_COLUMNS
+    :param results_dir: Folder of the results store
+    :return: DataFrame with the hourly results of the nodes, in long format
+    """
+    run_id = run_id or latest_run(results_dir)
+    nodes = list_result_nodes(run_id, results_dir) if nodes is None else nodes
+    paths = [get_node_path(run_id, node, results_dir) for node in nodes]
+    paths = [path for path in paths if os.path.exists(path)]
+    if len(paths) == 0:
+        return pd.DataFrame(columns=columns or list(RESULT_COLUMNS))
+
+    return pd.concat([pd.read_parquet(path, columns=columns) for path in paths],
+                     ignore_index=True)
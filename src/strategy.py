@@ -2,38 +2,99 @@ import os
 import itertools
 import numpy as np
 import pandas as pd
-from utils import get_texas_season
+from utils import get_texas_season, TEXAS_SEASON_BY_MONTH
+from data_store import DATA_PATH, read_node
+from market_calendar import DAYS_OF_WEEK, get_calendar_fields
 
 FILE_PATH = os.path.dirname(__file__)
 
+NODE_CALENDAR_COLUMNS = ['day_of_week', 'hour_ending', 'month_name', 'season']
 
-def get_node_data(settlement_point_name: str) -> pd.DataFrame:
+
+def get_node_data(settlement_point_name: str, data_dir: str = DATA_PATH) -> pd.DataFrame:
     """
     Get the virtual trading data for a specific node
     :param settlement_point_name: Name of the settlement point
+    :param data_dir: Folder with the virtual trading data
     :return: DataFrame with the virtual trading data for the node
     """
-    parent_folder = os.path.dirname(FILE_PATH)
-    DATA_PATH = os.path.join(parent_folder, 'data')
-    virtual_trading_data = pd.read_csv(os.path.join(DATA_PATH, 'virtual_trading_data.csv'))
-    node_data = virtual_trading_data[virtual_trading_data['settlementPoint'] == settlement_point_name].copy()
-    # Add common fields (day_of_week, hour, month_name, etc)
-    node_data["date"] = pd.to_datetime(node_data["date"])
-    node_data["day_of_week"] = node_data["date"].dt.day_name()
-    node_data["hour_ending"] = node_data["date"].dt.hour + 1
-    node_data["month_name"] = node_data["date"].dt.month_name()
-    # Season
-    node_data["season"] = node_data["date"].dt.quarter.map({1: 'Winter', 2: 'Spring', 3: 'Summer', 4: 'Fall'})
+    # Only the partition of the node is read, the store is rebuilt if the CSV changed
+    node_data = read_node(settlement_point_name, data_dir=data_dir)
     node_data = node_data.set_index("date")
+    # Add common fields (day_of_week, hour, month_name, etc) from the calendar shared by all the nodes
+    calendar_fields = get_calendar_fields(node_data.index, NODE_CALENDAR_COLUMNS, data_dir=data_dir)
+    node_data = node_data.join(calendar_fields)
 
     return node_data
 
 
+def get_window_means(node_data: pd.DataFrame, index: pd.DatetimeIndex):
+    """
+    Same-hour RT mean of the window 7 to 2 days back for all the dates of the index.
+    For every hour of the day the RT prices are accumulated in prefix sums, so the mean of
+    the window is a difference of two sums found by binary search.
+    :param node_data: DataFrame from get_node_data
+    :param index: Dates to price
+    :return: Tuple with the window mean, the number of prices in the window and the
+             all-history mean of the same hour (the fallback when the window is empty)
+    """
+    node_dates = node_data.index.values
+    node_hours = node_data["hour_ending"].to_numpy()
+    node_rt = node_data["SPP_RT"].to_numpy(dtype=float)
+
+    dates = index.values
+    hours = index.hour + 1
+    one_week_ago = dates - np.timedelta64(7, 'D')
+    two_days_ago = dates - np.timedelta64(2, 'D')
+
+    window_mean = np.full(len(index), np.nan)
+    window_count = np.zeros(len(index), dtype=int)
+    hour_mean = np.full(len(index), np.nan)
+    for hour in np.unique(hours):
+        in_hour = node_hours == hour
+        order = np.argsort(node_dates[in_hour], kind='stable')
+        hour_dates = node_dates[in_hour][order]
+        hour_rt = node_rt[in_hour][order]
+        # NaN prices are skipped by mean(), so they count neither in the sum nor in the size
+        has_price = ~np.isnan(hour_rt)
+        cum_rt = np.concatenate([[0.0], np.cumsum(np.where(has_price, hour_rt, 0.0))])
+        cum_count = np.concatenate([[0], np.cumsum(has_price)])
+
+        to_price = hours == hour
+        start = np.searchsorted(hour_dates, one_week_ago[to_price], side='left')
+        end = np.searchsorted(hour_dates, two_days_ago[to_price], side='right')
+        window_count[to_price] = cum_count[end] - cum_count[start]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            window_mean[to_price] = (cum_rt[end] - cum_rt[start]) / window_count[to_price]
+        if cum_count[-1] > 0:
+            hour_mean[to_price] = cum_rt[-1] / cum_count[-1]
+
+    return window_mean, window_count, hour_mean
+
+
+def get_offer_prices(window_mean: np.ndarray, window_count: np.ndarray, hour_mean: np.ndarray,
+                     min_margen) -> np.ndarray:
+    """
+    Offer price of Strategy.get_offer_price from the window statistics: the window mean minus the
+    margin, or the all-history mean of the hour when the window has no prices
+    :param window_mean: Same-hour RT mean of the window
+    :param window_count: Number of prices in the window
+    :param hour_mean: All-history RT mean of the same hour
+    :param min_margen: Margin, a number or an array that broadcasts with the means
+    :return: Array of offer prices
+    """
+    return np.where(window_count > 0, window_mean - min_margen, hour_mean)
+
+
 class Strategy:
-    def __init__(self, settlement_point_name: str, rules: list):
+    def __init__(self, settlement_point_name: str, rules: list, node_data: pd.DataFrame = None,
+                 price_aware: bool = False):
         self.settlement_point_name = settlement_point_name
-        self.node_data = get_node_data(settlement_point_name)
+        # Reuse the node data when the caller already loaded it
+        self.node_data = node_data if node_data is not None else get_node_data(settlement_point_name)
         self.rules = rules
+        # When True the bid is the offer price instead of np.inf
+        self.price_aware = price_aware
 
         self.min_margen = 5
 
@@ -46,7 +107,7 @@ class Strategy:
         # Only the same hour
         bid_price = df_for_bid[df_for_bid["hour_ending"] == (operation_date.hour + 1)]["SPP_RT"].mean() - self.min_margen
 
-        if bid_price is np.nan:
+        if np.isnan(bid_price):
             # Mean price in that hour
             bid_price = self.node_data[self.node_data["hour_ending"] == (operation_date.hour + 1)]["SPP_RT"].mean()
 
@@ -57,9 +118,46 @@ class Strategy:
         if not any([rule.is_applicable(operation_date) for rule in self.rules]):
             return -np.inf
 
-        #return self.get_offer_price(operation_date)
+        if self.price_aware:
+            return self.get_offer_price(operation_date)
         return np.inf
 
+    def get_offer_prices(self, index: pd.DatetimeIndex) -> np.ndarray:
+        """
+        Batch version of get_offer_price for all the dates of the index
+        :param index: Dates to price
+        :return: Array with the offer price of each date
+        """
+        return get_offer_prices(*self.get_window_means(index), self.min_margen)
+
+    def get_window_means(self, index: pd.DatetimeIndex):
+        """
+        Same-hour RT mean of the window 7 to 2 days back for all the dates of the index,
+        see get_window_means
+        """
+        return get_window_means(self.node_data, index)
+
+    def get_rules_mask(self) -> np.ndarray:
+        """
+        Compile the rules into a month x day of week x hour lookup table
+        :return: Boolean array of shape (12, 7, 24), True where any rule applies
+        """
+        mask = np.zeros((12, 7, 24), dtype=bool)
+        for rule in self.rules:
+            mask |= rule.get_mask()
+        return mask
+
+    def apply_rules_to_index(self, index: pd.DatetimeIndex) -> np.ndarray:
+        """
+        Same as mapping apply_rules over the index, but with a single lookup for all the dates
+        :param index: Dates to evaluate
+        :return: Array with np.inf where a rule applies and -np.inf otherwise
+        """
+        applicable = self.get_rules_mask()[index.month - 1, index.dayofweek, index.hour]
+        if self.price_aware:
+            return np.where(applicable, self.get_offer_prices(index), -np.inf)
+        return np.where(applicable, np.inf, -np.inf)
+
 
 class TimeBasedRule:
     def __init__(self, day_of_week: str, hour_range: list, season: str = None):
@@ -76,6 +174,22 @@ class TimeBasedRule:
         else:
             return date_time.day_name() == self.day_of_week and date_time.hour in self.hour_range
 
+    def get_mask(self) -> np.ndarray:
+        """
+        Lookup table equivalent to is_applicable
+        :return: Boolean array of shape (12, 7, 24) indexed by month - 1, day of week and hour
+        """
+        mask = np.zeros((12, 7, 24), dtype=bool)
+        if self.day_of_week not in DAYS_OF_WEEK:
+            return mask
+
+        hours = [hour for hour in self.hour_range if 0 <= hour < 24]
+        # The season only depends on the month
+        months = [month for month in range(12) if not self.season or TEXAS_SEASON_BY_MONTH[month] == self.season]
+        mask[np.ix_(months, [DAYS_OF_WEEK.index(self.day_of_week)], hours)] = True
+
+        return mask
+
     def __str__(self):
         # Super compressed representation
         # See if there are any consecutive hours and represent them as a range
@@ -88,3 +202,34 @@ class TimeBasedRule:
                 h_ranges.append(g[0][1])
 
         return f"{self.day_of_week[:3]}, {h_ranges})"
+
+
+def rules_from_mask(mask: np.ndarray) -> list:
+    """
+    Build one TimeBasedRule per day of week from a day of week x hour boolean table
+    :param mask: Boolean array of shape (7, 24)
+    :return: List of TimeBasedRule
+    """
+    rules = []
+    for dow, applicable_hours in zip(DAYS_OF_WEEK, mask):
+        h_list = [int(hour) for hour in np.flatnonzero(applicable_hours)]
+        if len(h_list) > 0:
+            rules.append(TimeBasedRule(day_of_week=dow, hour_range=h_list))
+
+    return rules
+
+
+def get_strategy_from_metadata(metadata: dict, node_data: pd.DataFrame = None) -> Strategy:
+    """
+    Rebuild the strategy a node was evaluated with from its metadata in the results store
+    :param metadata: Node metadata, as read with results_store.read_node_metadata
+    :param node_data: Optional node data, read from the store otherwise
+    :return: Strategy with the rules, price_aware and min_margen of the run
+    """
+    rules = [TimeBasedRule(**rule) for rule in metadata['time_based_rules']]
+    params = metadata.get('params', {})
+    strategy = Strategy(metadata['settlementPoint'], rules, node_data=node_data,
+                        price_aware=params.get('price_aware', False))
+    strategy.min_margen = params.get('min_margen', strategy.min_margen)
+
+    return strategy
@@ -0,0 +1,114 @@
+import itertools
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from data_store import DATA_PATH
+from metrics import get_max_drawdown
+from strategy import get_node_data, get_window_means, get_offer_prices
+from weekday_hour_stats import get_weekday_hour_stats, get_stats_cube
+
+SWEEP_STATISTICS = ['median', 'mean', 'win_rate']
+
+
+def get_award_matrix(node_data: pd.DataFrame, margins: list) -> np.ndarray:
+    """
+    Awarded hours of a node for every margin, assuming a bid on every hour
+    :param node_data: DataFrame from get_node_data
+    :param margins: Bidding margins, None stands for the np.inf bid
+    :return: Boolean array of shape (n_margins, n_hours)
+    """
+    spp_da = node_data["SPP_DA"].to_numpy(dtype=float)
+    window_means = get_window_means(node_data, node_data.index)
+
+    awarded = np.zeros((len(margins), len(node_data)), dtype=bool)
+    for i, margin in enumerate(margins):
+        if margin is None:
+            bid_price = np.full(len(node_data), np.inf)
+        else:
+            bid_price = get_offer_prices(*window_means, margin)
+        with np.errstate(invalid='ignore'):
+            awarded[i] = bid_price >= spp_da
+
+    return awarded
+
+
+def sweep_node(node_data: pd.DataFrame, selection: np.ndarray, margins: list) -> dict:
+    """
+    Evaluate every (rule set, margin) combination of a node with broadcast array operations
+    :param node_data: DataFrame from get_node_data
+    :param selection: Boolean array of shape (n_rule_sets, 7, 24) with the cells of each rule set
+    :param margins: Bidding margins, None stands for the np.inf bid
+    :return: Dict of metric name to array of shape (n_rule_sets, n_margins)
+    """
+    cells = node_data.index.dayofweek * 24 + node_data.index.hour
+    # (n_rule_sets, 1, n_hours): whether a rule applies to each hour
+    applies = selection.reshape(len(selection), 7 * 24)[:, cells][:, np.newaxis, :]
+    # (n_rule_sets, n_margins, n_hours): whether each hour is awarded
+    awarded = get_award_matrix(node_data, margins)[np.newaxis, :, :] & applies
+
+    spp_da = node_data["SPP_DA"].to_numpy(dtype=float)
+    hour_profit = np.nan_to_num(node_data["SPP_RT"].to_numpy(dtype=float) - spp_da)
+    profit = awarded * hour_profit
+    cost = (awarded * np.nan_to_num(spp_da)).sum(axis=-1)
+    total_profit = profit.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        roi = total_profit / cost
+
+    return {
+        'profit': total_profit,
+        'cost': cost,
+        'roi': roi,
+        'awarded': awarded.sum(axis=-1),
+        'max_drawdown': get_max_drawdown(profit),
+    }
+
+
+def sweep(thresholds, statistics: list = None, margins: list = None, nodes: list = None,
+          data_dir: str = DATA_PATH) -> pd.DataFrame:
+    """
+    Evaluate every combination of statistic, threshold and margin for every node.
+    A rule set bids on the (day of week, hour) cells where statistic > threshold.
+    :param thresholds: List of thresholds for all the statistics, or dict of statistic to thresholds
+    :param statistics: Statistics of the weekday hour table, median, mean and win_rate by default
+    :param margins: Bidding margins, None stands for the np.inf bid. [None, 5] by default
+    :param nodes: Optional list of nodes, all the nodes by default
+    :param data_dir: Folder with the virtual trading data
+    :return: Tidy DataFrame with one row per (node, statistic, threshold, margin)
+    """
+    statistics = SWEEP_STATISTICS if statistics is None else statistics
+    margins = [None, 5] if margins is None else margins
+    if not isinstance(thresholds, dict):
+        thresholds = {statistic: thresholds for statistic in statistics}
+    param_sets = [(statistic, threshold) for statistic in statistics for threshold in thresholds[statistic]]
+
+    # (n_rule_sets, n_nodes, 7, 24) selection of cells, computed once for all the nodes
+    stats = get_weekday_hour_stats(data_dir)
+    cubes = {statistic: get_stats_cube(stats, statistic) for statistic in statistics}
+    stat_nodes = cubes[statistics[0]][0]
+    selection = []
+    for statistic, threshold in param_sets:
+        with np.errstate(invalid='ignore'):
+            selection.append(cubes[statistic][1] > threshold)
+    selection = np.stack(selection)
+    nodes = list(stat_nodes) if nodes is None else nodes
+
+    results = []
+    for node in tqdm(nodes):
+        node_idx = np.searchsorted(stat_nodes, node)
+        if node_idx >= len(stat_nodes) or stat_nodes[node_idx] != node:
+            continue
+        node_data = get_node_data(node, data_dir=data_dir)
+        metrics = sweep_node(node_data, selection[:, node_idx], margins)
+
+        combinations = list(itertools.product(range(len(param_sets)), range(len(margins))))
+        df_node = pd.DataFrame({
+            'settlementPoint': node,
+            'statistic': [param_sets[i][0] for i, _ in combinations],
+            'threshold': [param_sets[i][1] for i, _ in combinations],
+            'margin': [margins[j] for _, j in combinations],
+        })
+        for name, values in metrics.items():
+            df_node[name] = values.reshape(-1)
+        results.append(df_node)
+
+    return pd.concat(results, ignore_index=True)
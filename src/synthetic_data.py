@@ -0,0 +1,102 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from data_store import DATA_PATH, get_source_path
+
+# Default price distributions, in USD/MWh
+PRICE_PARAMS = {
+    'da_mean': 40.0,           # Mean DA price of a typical node
+    'da_node_spread': 0.15,    # Lognormal spread of the price level between nodes
+    'da_daily_amplitude': 0.25,  # Relative amplitude of the daily shape (peak in the afternoon)
+    'da_season_amplitude': 0.2,  # Relative amplitude of the yearly shape (peak in summer)
+    'da_noise': 6.0,           # Std of the hourly DA noise
+    'rt_noise': 8.0,           # Std of the RT - DA difference
+    'rt_node_bias': 0.5,       # Std of the mean RT - DA difference between nodes
+    'spike_probability': 0.002,  # Probability of an RT price spike in an hour
+    'spike_scale': 80.0,       # Mean size of the spikes (exponential)
+}
+
+
+def get_node_names(n_nodes: int) -> list:
+    return [f'N{i}' for i in range(n_nodes)]
+
+
+def get_dates(years: float, start: str = '2022-01-01') -> pd.DatetimeIndex:
+    start = pd.Timestamp(start)
+    return pd.date_range(start, periods=int(round(years * 365 * 24)), freq='h', name='date')
+
+
+def generate_node_data(node_index: int, dates: pd.DatetimeIndex, seed: int = 0, **price_params) -> pd.DataFrame:
+    """
+    Hourly DA and RT prices of one synthetic node. The random stream of every node only depends
+    on the seed and its index, so a node is the same whatever the number of nodes.
+    :param node_index: Index of the node, the node is named N<index>
+    :param dates: Hours to generate
+    :param seed: Seed of the generator
+    :param price_params: Overrides of PRICE_PARAMS
+    :return: DataFrame with the columns of virtual_trading_data.csv
+    """
+    params = {**PRICE_PARAMS, **price_params}
+    rng = np.random.default_rng([seed, node_index])
+    n_hours = len(dates)
+
+    level = params['da_mean'] * rng.lognormal(0, params['da_node_spread'])
+    daily_shape = 1 + params['da_daily_amplitude'] * np.sin(2 * np.pi * (dates.hour.to_numpy() - 9) / 24)
+    season_shape = 1 + params['da_season_amplitude'] * np.cos(2 * np.pi * (dates.dayofyear.to_numpy() - 200) / 365)
+    spp_da = level * daily_shape * season_shape + rng.normal(0, params['da_noise'], n_hours)
+
+    spikes = (rng.random(n_hours) < params['spike_probability']) * rng.exponential(params['spike_scale'], n_hours)
+    spp_rt = spp_da + rng.normal(rng.normal(0, params['rt_node_bias']), params['rt_noise'], n_hours) + spikes
+
+    spp_da = np.round(spp_da, 2)
+    spp_rt = np.round(spp_rt, 2)
+    return pd.DataFrame({
+        'date': dates,
+        'settlementPoint': f'N{node_index}',
+        'SPP_DA': spp_da,
+        'SPP_RT': spp_rt,
+        'return_DA_RT': spp_rt - spp_da,
+    })
+
+
+def generate_virtual_trading_data(n_nodes: int = 10, years: float = 1, start: str = '2022-01-01', seed: int = 0,
+                                  **price_params) -> pd.DataFrame:
+    """
+    Synthetic virtual trading data with the shape of virtual_trading_data.csv, one node after the other
+    :param n_nodes: Number of nodes
+    :param years: Years of hourly data
+    :param start: First hour
+    :param seed: Seed of the generator
+    :param price_params: Overrides of PRICE_PARAMS
+    """
+    dates = get_dates(years, start)
+    return pd.concat([generate_node_data(i, dates, seed, **price_params) for i in range(n_nodes)], ignore_index=True)
+
+
+def write_virtual_trading_data(data_dir: str = DATA_PATH, n_nodes: int = 10, years: float = 1,
+                               start: str = '2022-01-01', seed: int = 0, **price_params) -> str:
+    """
+    Write synthetic data as the virtual_trading_data.csv of data_dir, one node at a time so memory
+    does not grow with the number of nodes
+    :return: Path of the CSV
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    source_path = get_source_path(data_dir)
+    dates = get_dates(years, start)
+    with open(source_path, 'w', newline='') as f:
+        for i in range(n_nodes):
+            generate_node_data(i, dates, seed, **price_params).to_csv(f, header=(i == 0), index=False)
+
+    return source_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic virtual trading data")
+    parser.add_argument("data_dir", help="Folder of the virtual_trading_data.csv to write")
+    parser.add_argument("--nodes", type=int, default=10, help="Number of nodes")
+    parser.add_argument("--years", type=float, default=1, help="Years of hourly data")
+    parser.add_argument("--start", default="2022-01-01", help="First hour")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generator")
+    args = parser.parse_args()
+    print(write_virtual_trading_data(args.data_dir, args.nodes, args.years, args.start, args.seed))
@@ -1,4 +1,44 @@
 from datetime import datetime, date
+import numpy as np
+
+# Texas-specific seasonal definitions
+TEXAS_SEASONS = {
+    # Early Winter (cooler, but not deep winter)
+    (11, 12, 1): 'Early Winter',
+
+    # Winter (January-February)
+    (2,): 'Winter',
+
+    # Early Spring (March-April, unpredictable weather)
+    (3, 4): 'Early Spring',
+
+    # Late Spring (May, getting hot)
+    (5,): 'Late Spring',
+
+    # Summer (June-August, intense heat)
+    (6, 7, 8): 'Summer',
+
+    # Late Summer/Early Fall (September, still very hot)
+    (9,): 'Late Summer',
+
+    # Fall (October-early November, pleasant)
+    (10, 11): 'Fall'
+}
+
+
+def _season_of_month(month):
+    # Find the matching season, the first definition wins (November is Early Winter)
+    for season_months, season_name in TEXAS_SEASONS.items():
+        if month in season_months:
+            return season_name
+
+    # Fallback (though this should never happen with the current mapping)
+    return 'Unknown'
+
+
+# Month -> season lookup, index 0 is January
+TEXAS_SEASON_BY_MONTH = np.array([_season_of_month(month) for month in range(1, 13)], dtype=object)
+
 
 def get_texas_season(input_date=None):
     """
@@ -19,39 +59,20 @@ def get_texas_season(input_date=None):
     if isinstance(input_date, datetime):
         input_date = input_date.date()
 
-    month = input_date.month
-
-    # Texas-specific seasonal definitions
-    texas_seasons = {
-        # Early Winter (cooler, but not deep winter)
-        (11, 12, 1): 'Early Winter',
-
-        # Winter (January-February)
-        (2,): 'Winter',
+    return TEXAS_SEASON_BY_MONTH[input_date.month - 1]
 
-        # Early Spring (March-April, unpredictable weather)
-        (3, 4): 'Early Spring',
 
-        # Late Spring (May, getting hot)
-        (5,): 'Late Spring',
-
-        # Summer (June-August, intense heat)
-        (6, 7, 8): 'Summer',
-
-        # Late Summer/Early Fall (September, still very hot)
-        (9,): 'Late Summer',
-
-        # Fall (October-early November, pleasant)
-        (10, 11): 'Fall'
-    }
+def get_texas_seasons(months):
+    """
+    Vectorized get_texas_season.
 
-    # Find the matching season
-    for season_months, season_name in texas_seasons.items():
-        if month in season_months:
-            return season_name
+    Args:
+        months (array-like of int): Months, 1 to 12.
 
-    # Fallback (though this should never happen with the current mapping)
-    return 'Unknown'
+    Returns:
+        numpy.ndarray: The season of each month
+    """
+    return TEXAS_SEASON_BY_MONTH[np.asarray(months) - 1]
 
 # Example usage
 if __name__ == "__main__":
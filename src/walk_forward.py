@@ -0,0 +1,197 @@
+import warnings
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from data_store import DATA_PATH, list_nodes, read_node
+from strategy import rules_from_mask, get_window_means, get_offer_prices
+
+# Statistics of the train windows: the median from the returns of each period and cell, the others
+# from the cumulative sums
+WALK_FORWARD_STATISTICS = ['median', 'mean', 'win_rate']
+N_CELLS = 7 * 24
+
+
+def get_period_cells(node_data: pd.DataFrame, freq: str = 'M'):
+    """
+    Period and (day of week, hour) cell of every row of a node
+    :return: Tuple with the PeriodIndex, the period of each row (position in the PeriodIndex) and its cell
+    """
+    periods = node_data.index.to_period(freq)
+    ordinals = periods.asi8 - periods.asi8.min()
+    n_periods = int(ordinals.max()) + 1
+    period_index = pd.period_range(start=periods.min(), periods=n_periods, freq=freq)
+    cells = node_data.index.dayofweek * 24 + node_data.index.hour
+
+    return period_index, ordinals, np.asarray(cells)
+
+
+def get_bid_prices(node_data: pd.DataFrame, price_aware: bool = False, min_margen: float = 5) -> np.ndarray:
+    """
+    Bid of every hour of a node when a rule applies, as in Strategy.apply_rules_to_index
+    :param node_data: DataFrame with date index and SPP_RT column
+    :param price_aware: Bid the offer price of Strategy.get_offer_prices instead of np.inf
+    :param min_margen: Margin of the offer price
+    :return: Array of bid prices
+    """
+    if not price_aware:
+        return np.full(len(node_data), np.inf)
+    # The offer prices only depend on the RT prices of the days before, so they are the same in every window
+    node_data = node_data.assign(hour_ending=node_data.index.hour + 1)
+    return get_offer_prices(*get_window_means(node_data, node_data.index), min_margen)
+
+
+def get_period_aggregates(node_data: pd.DataFrame, freq: str = 'M', price_aware: bool = False,
+                          min_margen: float = 5):
+    """
+    Cumulative sums by period and (day of week, hour) cell of a node
+    :param node_data: DataFrame with date index and SPP_DA, SPP_RT and return_DA_RT columns
+    :param freq: Period of the windows, months by default
+    :param price_aware: Score the offer prices of a price aware strategy instead of np.inf bids
+    :param min_margen: Margin of the offer prices
+    :return: Tuple with the PeriodIndex and a dict of arrays of shape (n_periods + 1, 168).
+             Row i holds the totals of the periods before i, so the window [a, b) is row b - row a
+    """
+    period_index, ordinals, cells = get_period_cells(node_data, freq)
+    n_periods = len(period_index)
+    flat_idx = ordinals * N_CELLS + cells
+
+    returns = node_data["return_DA_RT"].to_numpy(dtype=float)
+    spp_da = node_data["SPP_DA"].to_numpy(dtype=float)
+    # Awarded when the bid covers the DA price, like evaluate_performance
+    awarded = get_bid_prices(node_data, price_aware, min_margen) >= spp_da
+    profit = np.where(awarded, node_data["SPP_RT"].to_numpy(dtype=float) - spp_da, 0.0)
+    has_return = ~np.isnan(returns)
+
+    values = {
+        'count': has_return,
+        'return_sum': np.where(has_return, returns, 0.0),
+        'wins': returns > 0,
+        'awarded': awarded,
+        'profit': np.nan_to_num(profit),
+        'cost': np.where(awarded, spp_da, 0.0),
+    }
+
+    aggregates = {}
+    for name, value in values.items():
+        by_cell = np.bincount(flat_idx, weights=value, minlength=n_periods * N_CELLS).reshape(n_periods, N_CELLS)
+        aggregates[name] = np.vstack([np.zeros((1, N_CELLS)), np.cumsum(by_cell, axis=0)])
+
+    return period_index, aggregates
+
+
+def get_period_returns(node_data: pd.DataFrame, freq: str = 'M') -> np.ndarray:
+    """
+    Returns of a node by period and (day of week, hour) cell, padded with NaN to the largest cell
+    :param node_data: DataFrame with date index and return_DA_RT column
+    :param freq: Period of the windows, months by default
+    :return: Array of shape (n_periods, 168, max hours of a cell in a period)
+    """
+    period_index, ordinals, cells = get_period_cells(node_data, freq)
+    flat_idx = ordinals * N_CELLS + cells
+    # Position of every hour within its (period, cell)
+    order = np.argsort(flat_idx, kind='stable')
+    sorted_idx = flat_idx[order]
+    group_start = np.searchsorted(sorted_idx, sorted_idx, side='left')
+    position = np.empty(len(flat_idx), dtype=int)
+    position[order] = np.arange(len(flat_idx)) - group_start
+
+    returns = np.full((len(period_index) * N_CELLS, position.max() + 1), np.nan)
+    returns[flat_idx, position] = node_data["return_DA_RT"].to_numpy(dtype=float)
+    return returns.reshape(len(period_index), N_CELLS, -1)
+
+
+def get_window_medians(period_returns: np.ndarray, starts: np.ndarray, n_periods: int) -> np.ndarray:
+    """
+    Median return of every cell over the windows [start, start + n_periods)
+    :param period_returns: Output of get_period_returns
+    :param starts: First period of each window
+    :param n_periods: Periods of each window
+    :return: Array of shape (n_windows, 168), NaN for the cells without returns
+    """
+    # View of shape (n_windows, 168, max hours, n_periods), only the selected windows are copied
+    windows = np.lib.stride_tricks.sliding_window_view(period_returns, n_periods, axis=0)[starts]
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', message='All-NaN slice')
+        return np.nanmedian(windows.reshape(len(starts), N_CELLS, -1), axis=2)
+
+
+def walk_forward_node(node_data: pd.DataFrame, train_periods: int = 12, test_periods: int = 1, step: int = 1,
+                      statistic: str = 'median', cond=lambda x: x > 1, freq: str = 'M', price_aware: bool = False,
+                      min_margen: float = 5) -> pd.DataFrame:
+    """
+    Walk forward evaluation of a node: the rules are derived on each train window and only
+    scored on the test window that follows it. All the windows are evaluated at once.
+    The bids are np.inf, or the offer prices of a price aware strategy with min_margen.
+    :param node_data: DataFrame from get_node_data
+    :param train_periods: Number of periods used to derive the rules
+    :param test_periods: Number of periods used to score the rules
+    :param step: Number of periods between two windows
+    :param statistic: One of WALK_FORWARD_STATISTICS
+    :param cond: Vectorized condition on the statistic of each (day of week, hour) cell
+    :param freq: Period of the windows, months by default
+    :param price_aware: Score the offer prices of a price aware strategy instead of np.inf bids
+    :param min_margen: Margin of the offer prices
+    :return: DataFrame with one row per window
+    """
+    if statistic not in WALK_FORWARD_STATISTICS:
+        raise ValueError(f"statistic must be one of {WALK_FORWARD_STATISTICS}, got {statistic}")
+
+    period_index, aggregates = get_period_aggregates(node_data, freq, price_aware, min_margen)
+    starts = np.arange(0, len(period_index) - train_periods - test_periods + 1, step)
+    train_ends = starts + train_periods
+    test_ends = train_ends + test_periods
+
+    def window_total(name, start, end):
+        return aggregates[name][end] - aggregates[name][start]
+
+    train_count = window_total('count', starts, train_ends)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if statistic == 'median':
+            train_stat = get_window_medians(get_period_returns(node_data, freq), starts, train_periods)
+        elif statistic == 'mean':
+            train_stat = window_total('return_sum', starts, train_ends) / train_count
+        else:
+            train_stat = window_total('wins', starts, train_ends) / train_count
+        mask = np.asarray(cond(train_stat)) & (train_count > 0)
+
+    profit = (mask * window_total('profit', train_ends, test_ends)).sum(axis=1)
+    cost = (mask * window_total('cost', train_ends, test_ends)).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        roi = profit / cost
+
+    return pd.DataFrame({
+        'settlementPoint': node_data['settlementPoint'].iloc[0] if len(node_data) else None,
+        'train_start': period_index[starts].start_time,
+        'test_start': period_index[train_ends].start_time,
+        'test_end': period_index[test_ends - 1].end_time,
+        'n_cells': mask.sum(axis=1),
+        'awarded': (mask * window_total('awarded', train_ends, test_ends)).sum(axis=1).astype(int),
+        'profit': profit,
+        'cost': cost,
+        'roi': roi,
+        'rules': [' & '.join(str(rule) for rule in rules_from_mask(window_mask.reshape(7, 24))) for window_mask in mask],
+    })
+
+
+def walk_forward_all_nodes(nodes: list = None, data_dir: str = DATA_PATH, **kwargs) -> pd.DataFrame:
+    """
+    walk_forward_node for every node of the store
+    :param nodes: Optional list of nodes, all the nodes by default
+    :param data_dir: Folder with the virtual trading data
+    :param kwargs: Window settings passed to walk_forward_node
+    :return: DataFrame with one row per (node, window)
+    """
+    nodes = list_nodes(data_dir) if nodes is None else nodes
+    columns = ['date', 'settlementPoint', 'SPP_DA', 'SPP_RT', 'return_DA_RT']
+    results = []
+    for node in tqdm(nodes):
+        node_data = read_node(node, columns=columns, data_dir=data_dir).set_index('date').sort_index()
+        if len(node_data) > 0:
+            results.append(walk_forward_node(node_data, **kwargs))
+
+    return pd.concat(results, ignore_index=True)
+
+
+if __name__ == "__main__":
+    df_walk_forward = walk_forward_all_nodes()
+    print(df_walk_forward.groupby('settlementPoint')[['profit', 'cost', 'awarded']].sum())
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+from data_store import DATA_PATH, list_nodes, read_node, read_weekday_hour_moments, load_cached_table
+from strategy import rules_from_mask
+
+STATS_TABLE = 'virtual_trading_weekday_hour'
+STATISTICS = ['median', 'mean', 'std', 'count', 'win_rate']
+
+
+def build_weekday_hour_stats(data_dir: str = DATA_PATH) -> pd.DataFrame:
+    """
+    Statistics of return_DA_RT by node, day of week and hour.
+    Mean, std, count and win rate come from the moments collected while ingesting the CSV,
+    the median is computed one node partition at a time, so memory stays bounded.
+    :param data_dir: Folder with the virtual trading data
+    :return: DataFrame with one row per (settlementPoint, day_of_week, hour)
+    """
+    stats = read_weekday_hour_moments(data_dir).set_index(['settlementPoint', 'day_of_week', 'hour'])
+    stats["count"] = stats["count"].astype(np.int64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats["mean"] = stats["sum"] / stats["count"]
+        variance = (stats["sum_sq"] - stats["sum"] * stats["mean"]) / (stats["count"] - 1)
+        stats["std"] = np.sqrt(variance.clip(lower=0))
+        stats["win_rate"] = stats["wins"] / stats["count"]
+    stats.loc[stats["count"] == 0, "mean"] = np.nan
+    stats.loc[stats["count"] < 2, "std"] = np.nan
+
+    medians = []
+    for node in list_nodes(data_dir):
+        node_data = read_node(node, columns=['date', 'return_DA_RT'], data_dir=data_dir)
+        node_median = node_data.groupby([node_data["date"].dt.dayofweek, node_data["date"].dt.hour])["return_DA_RT"].median()
+        node_median.index = pd.MultiIndex.from_tuples([(node, dow, hour) for dow, hour in node_median.index],
+                                                      names=['settlementPoint', 'day_of_week', 'hour'])
+        medians.append(node_median.astype(np.float64))
+    stats["median"] = pd.concat(medians)
+
+    return stats[STATISTICS].reset_index()
+
+
+def get_weekday_hour_stats(data_dir: str = DATA_PATH) -> pd.DataFrame:
+    """
+    Cached version of build_weekday_hour_stats, rebuilt only when the source data changes
+    """
+    return load_cached_table(STATS_TABLE, build_weekday_hour_stats, data_dir=data_dir)
+
+
+def get_stats_cube(stats: pd.DataFrame, statistic: str = 'median'):
+    """
+    Arrange one statistic as a node x day of week x hour array
+    :param stats: Output of get_weekday_hour_stats
+    :param statistic: One of STATISTICS
+    :return: Tuple with the array of node names and the (n_nodes, 7, 24) array, NaN for missing cells
+    """
+    nodes = np.sort(stats['settlementPoint'].unique())
+    cube = np.full((len(nodes), 7, 24), np.nan)
+    node_idx = np.searchsorted(nodes, stats['settlementPoint'].to_numpy())
+    cube[node_idx, stats['day_of_week'].to_numpy(), stats['hour'].to_numpy()] = stats[statistic].to_numpy()
+
+    return nodes, cube
+
+
+def derive_rules(stats: pd.DataFrame, statistic: str = 'median', cond=lambda x: x > 1) -> dict:
+    """
+    Rules of every node: the (day of week, hour) cells where cond holds for the statistic
+    :param stats: Output of get_weekday_hour_stats
+    :param statistic: One of STATISTICS
+    :param cond: Vectorized condition applied to the statistic cube
+    :return: Dict of node name to list of TimeBasedRule, in node name order
+    """
+    nodes, cube = get_stats_cube(stats, statistic)
+    # Missing cells are NaN and never pass the condition
+    with np.errstate(invalid='ignore'):
+        mask = np.asarray(cond(cube)) & ~np.isnan(cube)
+
+    return {node: rules_from_mask(node_mask) for node, node_mask in zip(nodes, mask)}
+
+
+def describe_rules(rules: list) -> str:
+    return '\n'.join(f"TimeBasedRule(day_of_week='{rule.day_of_week}', hour_range={rule.hour_range})," for rule in rules)
+
+
+if __name__ == "__main__":
+    rules_by_node = derive_rules(get_weekday_hour_stats())
+    for node, rules in rules_by_node.items():
+        print(f"{node}:\n{describe_rules(rules)}")